@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+# Offline benchmarks for Jeeves. No network or Discord connection is needed.
+#
+#   python benchmark.py replay --db cache.db --limit 200 --concurrency 8 --latency 0.2
+#   python benchmark.py replay --jsonl recorded.jsonl
+#   python benchmark.py loadtest --channels 1000 --messages 5 --latency 0.5 --error-rate 0.02
+#   python benchmark.py loadtest --base-url http://127.0.0.1:8088/v1   (against openai_stub.py)
+#   python benchmark.py serialize --tool-calls 32
+#   python benchmark.py views --tool-calls 64
+from typing import Any, Dict, List, Optional, Tuple
+from collections import defaultdict
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from gpt import ChatBackend, ChatResponse, MagicDict, ChatMock, ChatOpenAI, ChatSqliteCache, ChatAccounting, set_accounting_labels
+from servant.base.tools import ToolDispatcher
+from servant.base.metrics import LatencyHistogram
+from servant.base.tracing import CollectingSpanExporter, set_span_exporter
+from servant.base.messaging import ChannelSendQueue
+
+
+def load_servant_script():
+    # servant.py is shadowed by the servant/ package, so load it by path.
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'servant.py')
+    spec = importlib.util.spec_from_file_location('jeeves', path)
+    module = importlib.util.module_from_spec(spec)
+    # dataclasses looks the module up in sys.modules to resolve (postponed) annotations
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+###################################################################################################
+# Recorded conversations
+###################################################################################################
+
+_USER_MESSAGE_RE = re.compile(r'^Message from (.*?): (.*)$', re.DOTALL)
+
+
+def _recorded_turn(request: Dict[str, Any], response: Dict[str, Any]) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    for message in reversed(request.get('messages', [])):
+        if message.get('role') == 'user' and isinstance(message.get('content'), str):
+            m = _USER_MESSAGE_RE.match(message['content'])
+            if m is None:
+                return None
+            return m.group(1), m.group(2), response
+    return None
+
+
+def load_recorded_turns(db_path: Optional[str] = None, jsonl_path: Optional[str] = None, limit: Optional[int] = None) -> List[Tuple[str, str, Dict[str, Any]]]:
+    # Returns (author, content, recorded_response) for every recorded request whose last user message
+    # is a Discord message. Sources: the ChatSqliteCache table and/or a JSONL file of
+    # {"request": ..., "response": ...} lines.
+    turns = []
+    if db_path is not None:
+        conn = sqlite3.connect(db_path)
+        for request, response in conn.execute('SELECT request, response FROM chat_cache ORDER BY request_start'):
+            turn = _recorded_turn(json.loads(request), json.loads(response))
+            if turn is not None:
+                turns.append(turn)
+        conn.close()
+    if jsonl_path is not None:
+        with open(jsonl_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                turn = _recorded_turn(record['request'], record['response'])
+                if turn is not None:
+                    turns.append(turn)
+    return turns[:limit] if limit is not None else turns
+
+
+###################################################################################################
+# Fakes
+###################################################################################################
+
+class FakeUser:
+    def __init__(self, id: int, name: str):
+        self.id = id
+        self.name = name
+        self.discriminator = '0'
+
+    def __str__(self):
+        return self.name
+
+
+class _FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeChannel:
+    def __init__(self, id: int):
+        self.id = id
+        self.sent: List[str] = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+    def typing(self):
+        return _FakeTyping()
+
+
+class FakeMessage:
+    _next_id = 1
+
+    def __init__(self, channel: FakeChannel, author: FakeUser, content: str):
+        self.id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        self.channel = channel
+        self.author = author
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, user):
+        pass
+
+
+class FakeClient:
+    def __init__(self):
+        self.user = FakeUser(0, 'Jeeves')
+
+
+class ReplayBackend(ChatBackend):
+    # Serves the recorded response for the message being replayed after `latency` seconds.
+    # Tool calls in recorded responses are answered with a canned stop message on the next round,
+    # so replay never depends on the network.
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.pending: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.request_count = 0
+
+    def expect(self, channel_id: str, response: Dict[str, Any]) -> None:
+        self.pending[channel_id].append(response)
+
+    async def async_request(self, channel_id: str = '', **kwargs) -> ChatResponse:
+        self.request_count += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        t = time.time()
+        queue = self.pending.get(channel_id)
+        if queue:
+            response = json.loads(json.dumps(queue.pop(0)))
+        else:
+            response = {
+                'model': 'replay',
+                'choices': [{'finish_reason': 'stop', 'index': 0, 'message': {'role': 'assistant', 'content': 'Very good.'}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+            }
+        return ChatResponse.from_dict(response, timing={'start': t - self.latency, 'end': t})
+
+
+class _ChannelRouting(ChatBackend):
+    # handle_incoming_message doesn't pass the channel to the backend, so route through a per-channel shim.
+    def __init__(self, backend: ReplayBackend, channel_id: str):
+        self.backend = backend
+        self.channel_id = channel_id
+
+    async def async_request(self, **kwargs) -> ChatResponse:
+        return await self.backend.async_request(channel_id=self.channel_id, **kwargs)
+
+
+def _offline_tools(state) -> ToolDispatcher:
+    import servant.tools
+
+    tools = ToolDispatcher({})
+    servant.tools.register_builtin_tools(tools)
+    state.register_tools(tools)
+
+    # Other tools talk to the network; answer them with a canned error but keep the real schemas.
+    async def unavailable(obj):
+        return {'error': 'Tool unavailable in replay.'}
+    for name in ['get_current_weather', 'get_current_weather_batch', 'get_distance_matrix']:
+        tools.register(name=name, schema=tools.tools[name].schema, function=unavailable)
+    for name in ['switch_personality', 'generate_image', 'generate_meme']:
+        tools.register(name=name, schema={'type': 'function', 'function': {'name': name, 'description': f'{name} (replay stub)'}}, function=unavailable)
+    return tools
+
+
+###################################################################################################
+# Replay
+###################################################################################################
+
+async def run_replay(turns: List[Tuple[str, str, Dict[str, Any]]], latency: float, concurrency: int) -> Dict[str, Any]:
+    jeeves = load_servant_script()
+    config = jeeves.Config()
+    config.personalities['Jeeves'] = jeeves.AgentDescription(name='Jeeves', description='You are Jeeves, a helpful butler.')
+    state = jeeves.JeevesState(config=config)
+    # Measure our own latency, not Discord's per-channel send pacing; never fall back to attachments
+    state.send_queue = ChannelSendQueue(rate=1e9, burst=1 << 30, max_chunks=1 << 30)
+    tools = _offline_tools(state)
+    backend = ReplayBackend(latency=latency)
+    client = FakeClient()
+
+    exporter = CollectingSpanExporter()
+    set_span_exporter(exporter)
+
+    channels = [FakeChannel(1000 + i) for i in range(concurrency)]
+    users: Dict[str, FakeUser] = {}
+    message_latency = LatencyHistogram(window=len(turns) or 1)
+
+    async def worker(channel: FakeChannel, channel_turns):
+        channel_id = str(channel.id)
+        routed = _ChannelRouting(backend, channel_id)
+        for author, content, response in channel_turns:
+            user = users.setdefault(author, FakeUser(len(users) + 1, author))
+            message = FakeMessage(channel, user, content)
+            # Same bookkeeping as MyClient.on_message
+            state.channel_messages[channel_id].append({'role': 'user', 'content': f'Message from {author}: {content}'})
+            backend.expect(channel_id, response)
+
+            t0 = time.perf_counter()
+            await state.handle_incoming_message(client=client, discord_message=message, openai_client=routed, tools=tools)
+            message_latency.observe(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker(channel, turns[i::concurrency]) for i, channel in enumerate(channels)])
+    elapsed = time.perf_counter() - t0
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    set_span_exporter(None)
+
+    stages: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+    for s in exporter.spans:
+        stages[s.name].observe(s.duration)
+
+    return {
+        'messages': len(turns),
+        'llm_requests': backend.request_count,
+        'concurrency': concurrency,
+        'backend_latency': latency,
+        'elapsed': elapsed,
+        'throughput': len(turns) / elapsed if elapsed > 0 else 0.0,
+        'message_latency': message_latency.to_json(),
+        'stages': {name: h.to_json() for name, h in sorted(stages.items())},
+        'peak_traced_memory_bytes': peak_memory,
+        'replies_sent': sum(len(c.sent) for c in channels)
+    }
+
+
+def _print_replay_report(report: Dict[str, Any]) -> None:
+    print(f"Replayed {report['messages']} messages ({report['llm_requests']} LLM requests) over {report['concurrency']} channels "
+          f"in {report['elapsed']:.3f}s: {report['throughput']:.1f} msg/s")
+    ml = report['message_latency']
+    print(f"Message latency: p50={ml['p50'] * 1000:.2f}ms p95={ml['p95'] * 1000:.2f}ms p99={ml['p99'] * 1000:.2f}ms")
+    print(f"Peak traced memory: {report['peak_traced_memory_bytes'] / 1024 / 1024:.2f} MiB")
+    print(f"{'stage':<20} {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for name, h in report['stages'].items():
+        print(f"{name:<20} {h['count']:>8} {h['p50'] * 1000:>10.3f} {h['p95'] * 1000:>10.3f} {h['p99'] * 1000:>10.3f}")
+
+
+###################################################################################################
+# Load test
+###################################################################################################
+
+async def run_loadtest(channels: int, messages: int, latency: float, error_rate: float,
+                       base_url: Optional[str], repeat_fraction: float, seed: int) -> Dict[str, Any]:
+    # Synthetic channels send messages through the production decorator chain:
+    # ChatAccounting(ChatSqliteCache(ChatOpenAI against the stub server | ChatMock)).
+    import openai
+    import random as _random
+
+    if base_url is not None:
+        backend = ChatOpenAI(openai.AsyncOpenAI(base_url=base_url, api_key='stub', max_retries=0), defaults={'model': 'mock'})
+    else:
+        backend = ChatMock(latency=latency, error_rate=error_rate, seed=seed)
+    accounting = ChatAccounting(ChatSqliteCache(backend, ':memory:'))
+
+    rng = _random.Random(seed)
+    errors = 0
+    repeats = 0
+    message_latency = LatencyHistogram(window=channels * messages)
+    # Prompts that have already been answered (by any channel), so repeats hit the cache
+    answered: List[str] = []
+
+    async def channel(channel_index: int):
+        nonlocal errors, repeats
+        set_accounting_labels(channel=str(channel_index))
+        history = [{'role': 'system', 'content': 'You are a load test.'}]
+        for i in range(messages):
+            # Some messages repeat a prompt answered earlier to exercise the cache.
+            if answered and rng.random() < repeat_fraction:
+                content = rng.choice(answered)
+                repeats += 1
+            else:
+                content = f'Message from user{channel_index}: synthetic message {i}'
+            request = history[:1] + [{'role': 'user', 'content': content}]
+            t0 = time.perf_counter()
+            try:
+                await accounting.async_request(messages=request)
+                answered.append(content)
+            except openai.APIError:
+                errors += 1
+            message_latency.observe(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[channel(i) for i in range(channels)])
+    elapsed = time.perf_counter() - t0
+
+    total = channels * messages
+    return {
+        'requests': total,
+        'errors': errors,
+        'repeats': repeats,
+        'cached': accounting.total_cached_count,
+        'elapsed': elapsed,
+        'throughput': total / elapsed if elapsed > 0 else 0.0,
+        'request_latency': message_latency.to_json(),
+        'accounting': accounting.to_json()
+    }
+
+
+###################################################################################################
+# Startup
+###################################################################################################
+
+def _startup_child() -> None:
+    # Runs in a fresh interpreter: time from interpreter start to a ready tool registry,
+    # then the cost of the first lazy tool module resolution.
+    t0 = time.perf_counter()
+    jeeves = load_servant_script()
+    t_import = time.perf_counter()
+
+    import servant.tools
+    tools = ToolDispatcher({})
+    servant.tools.register_builtin_tools(tools)
+    state = jeeves.JeevesState(config=jeeves.Config())
+    state.register_tools(tools)
+    schema_size = len(json.dumps(tools.schema))
+    t_ready = time.perf_counter()
+    modules_at_ready = len(sys.modules)
+
+    first_resolve = {}
+    for name in ['get_current_weather', 'get_distance_matrix']:
+        t = time.perf_counter()
+        try:
+            tools.tools[name].resolve()
+            first_resolve[name] = time.perf_counter() - t
+        except ImportError as e:
+            first_resolve[name] = f'unavailable: {e}'
+
+    print(json.dumps({
+        'import': t_import - t0,
+        'ready': t_ready - t0,
+        'modules_at_ready': modules_at_ready,
+        'schema_bytes': schema_size,
+        'first_resolve': first_resolve
+    }))
+
+
+def run_startup(runs: int) -> Dict[str, Any]:
+    import subprocess
+    import statistics
+
+    results = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '_startup_child'], check=True, capture_output=True, text=True).stdout
+        wall = time.perf_counter() - t0
+        result = json.loads(out.strip().splitlines()[-1])
+        result['process_wall'] = wall
+        results.append(result)
+
+    return {
+        'runs': runs,
+        'median_import': statistics.median(r['import'] for r in results),
+        'median_ready': statistics.median(r['ready'] for r in results),
+        'median_process_wall': statistics.median(r['process_wall'] for r in results),
+        'modules_at_ready': results[-1]['modules_at_ready'],
+        'schema_bytes': results[-1]['schema_bytes'],
+        'first_resolve': results[-1]['first_resolve']
+    }
+
+
+###################################################################################################
+# Serialization
+###################################################################################################
+
+def _legacy_obj_to_dict(obj, emit_null=True):
+    # The isinstance-chain serializer obj_to_json replaced, kept as the baseline
+    if isinstance(obj, list):
+        return [_legacy_obj_to_dict(o) for o in obj]
+    elif isinstance(obj, dict):
+        return {k: _legacy_obj_to_dict(v) for k, v in obj.items() if emit_null or v is not None}
+    elif isinstance(obj, int) or isinstance(obj, float) or isinstance(obj, str) or isinstance(obj, bool) or obj is None:
+        return obj
+    else:
+        return _legacy_obj_to_dict(obj.__dict__)
+
+
+def _time_per_call(fn, obj, iterations: int) -> float:
+    fn(obj)
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn(obj)
+    return (time.perf_counter() - t0) / iterations
+
+
+def run_serialize(tool_calls: int, iterations: int) -> Dict[str, Any]:
+    from servant.base.json import obj_to_json, dumps_bytes
+    from servant.geo import GeocoderResult
+    from gpt import mock_completion
+
+    completion = mock_completion({
+        'content': 'Checking the weather for everyone. ' * 20,
+        'tool_calls': [
+            {'name': 'get_current_weather', 'arguments': {'location': {'latitude': 40.7 + i / 100, 'longitude': -74.0 - i / 100}}}
+            for i in range(tool_calls)
+        ]}, model='gpt-4o', prompt_tokens=1500)
+
+    payloads: Dict[str, Any] = {}
+    try:
+        from openai.types.chat import ChatCompletion
+        payloads['openai_response'] = ChatCompletion.model_validate(completion)
+    except ImportError:
+        print('openai is not installed; benchmarking the plain dict response only.', file=sys.stderr)
+    payloads['dict_response'] = completion
+    payloads['geocoder_results'] = [
+        GeocoderResult(location=f'Place {i}', longitude=float(i), latitude=float(-i), country='US', state=None, city=f'City {i}', street=None)
+        for i in range(tool_calls * 10)
+    ]
+
+    report: Dict[str, Any] = {'tool_calls': tool_calls, 'iterations': iterations, 'results': {}}
+    for name, payload in payloads.items():
+        report['results'][name] = {
+            'legacy_obj_to_dict': _time_per_call(lambda o: _legacy_obj_to_dict(o, emit_null=False), payload, iterations),
+            'obj_to_json': _time_per_call(lambda o: obj_to_json(o, emit_null=False), payload, iterations),
+            'legacy_json_dumps': _time_per_call(lambda o: json.dumps(_legacy_obj_to_dict(o), ensure_ascii=False).encode('utf-8'), payload, iterations),
+            'dumps_bytes': _time_per_call(dumps_bytes, payload, iterations),
+        }
+    return report
+
+
+class _LegacyMagicDict(dict):
+    # MagicDict before JSONView: every nested access returned a fresh copy
+    def __getattr__(self, key):
+        r = self[key]
+        if isinstance(r, dict) and not isinstance(r, _LegacyMagicDict):
+            return _LegacyMagicDict(r)
+        return r
+
+    def __getitem__(self, key):
+        r = super().__getitem__(key)
+        if isinstance(r, dict) and not isinstance(r, _LegacyMagicDict):
+            return _LegacyMagicDict(r)
+        return r
+
+
+def run_views(tool_calls: int, iterations: int) -> Dict[str, Any]:
+    from gpt import mock_completion
+
+    completion = mock_completion({
+        'content': None,
+        'tool_calls': [
+            {'name': 'get_current_weather', 'arguments': {'location': {'latitude': 40.7 + i / 100, 'longitude': -74.0 - i / 100}}}
+            for i in range(tool_calls)
+        ]}, model='gpt-4o', prompt_tokens=1500)
+    # Large nested payloads as carried by tool-call responses (e.g. logprobs, per-call metadata)
+    completion['system_fingerprint'] = {'calls': {f'call_{i}': {'index': i, 'tokens': list(range(32))} for i in range(tool_calls)}}
+    completion[ChatBackend.TIMING_FIELD] = {'start': 0.0, 'end': 1.0}
+
+    def access(response) -> int:
+        # The access pattern of ChatAccounting and handle_incoming_message
+        total = response.usage.prompt_tokens + response.usage.completion_tokens
+        timing = response[ChatBackend.TIMING_FIELD]
+        total += int(timing['end'] - timing['start'])
+        total += len(response.choices[0]['message']['tool_calls'])
+        total += len(response.system_fingerprint.calls)
+        return total
+
+    def magic_dict_roundtrip(text: str) -> int:
+        # Cache hit and store as done before ChatResponse: parse, wrap, serialize again
+        response = MagicDict(json.loads(text))
+        total = access(response)
+        return total + len(json.dumps(response))
+
+    def chat_response_roundtrip(raw: bytes) -> int:
+        response = ChatResponse.from_bytes(raw, timing=completion[ChatBackend.TIMING_FIELD])
+        total = access(response)
+        return total + len(response.to_bytes())
+
+    legacy = _LegacyMagicDict(completion)
+    current = MagicDict(completion)
+    text = json.dumps(completion)
+    return {
+        'tool_calls': tool_calls,
+        'iterations': iterations,
+        'legacy_magic_dict': _time_per_call(access, legacy, iterations),
+        'magic_dict_views': _time_per_call(access, current, iterations),
+        'magic_dict_cache_roundtrip': _time_per_call(magic_dict_roundtrip, text, iterations),
+        'chat_response_cache_roundtrip': _time_per_call(chat_response_roundtrip, text.encode('utf-8'), iterations),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Offline Jeeves benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    replay = subparsers.add_parser('replay', help='Replay recorded conversations through JeevesState.handle_incoming_message.')
+    replay.add_argument('--db', help='SQLite database with a chat_cache table (see ChatSqliteCache).')
+    replay.add_argument('--jsonl', help='JSONL file of {"request": ..., "response": ...} records.')
+    replay.add_argument('--limit', type=int, default=None, help='Replay at most this many messages.')
+    replay.add_argument('--concurrency', type=int, default=1, help='Number of channels replayed concurrently.')
+    replay.add_argument('--latency', type=float, default=0.0, help='Simulated backend latency in seconds.')
+    replay.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    loadtest = subparsers.add_parser('loadtest', help='Drive synthetic channels through the caching/accounting/retry backend chain.')
+    loadtest.add_argument('--channels', type=int, default=100, help='Number of concurrent synthetic channels.')
+    loadtest.add_argument('--messages', type=int, default=5, help='Messages sent per channel.')
+    loadtest.add_argument('--latency', type=float, default=0.1, help='ChatMock latency in seconds (ignored with --base-url).')
+    loadtest.add_argument('--error-rate', type=float, default=0.0, help='ChatMock error rate (ignored with --base-url).')
+    loadtest.add_argument('--base-url', default=None, help='Use ChatOpenAI against an OpenAI-compatible server such as openai_stub.py.')
+    loadtest.add_argument('--repeat-fraction', type=float, default=0.1, help='Fraction of messages that repeat a cached prompt.')
+    loadtest.add_argument('--seed', type=int, default=0)
+    loadtest.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    startup = subparsers.add_parser('startup', help='Measure cold start (fresh interpreter) to a ready tool registry.')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    serialize = subparsers.add_parser('serialize', help='Compare obj_to_json/dumps_bytes with the old recursive serializer.')
+    serialize.add_argument('--tool-calls', type=int, default=32, help='Tool calls in the synthetic response.')
+    serialize.add_argument('--iterations', type=int, default=2000)
+    serialize.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    views = subparsers.add_parser('views', help='Compare nested MagicDict access with the old copying MagicDict.')
+    views.add_argument('--tool-calls', type=int, default=64, help='Tool calls in the synthetic response.')
+    views.add_argument('--iterations', type=int, default=20000)
+    views.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    subparsers.add_parser('_startup_child')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'replay':
+        if args.db is None and args.jsonl is None:
+            parser.error('replay needs --db and/or --jsonl')
+        turns = load_recorded_turns(db_path=args.db, jsonl_path=args.jsonl, limit=args.limit)
+        if not turns:
+            print('No recorded Discord messages found.', file=sys.stderr)
+            return 1
+        report = asyncio.run(run_replay(turns, latency=args.latency, concurrency=args.concurrency))
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            _print_replay_report(report)
+
+    elif args.command == 'loadtest':
+        report = asyncio.run(run_loadtest(
+            channels=args.channels, messages=args.messages, latency=args.latency, error_rate=args.error_rate,
+            base_url=args.base_url, repeat_fraction=args.repeat_fraction, seed=args.seed))
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            rl = report['request_latency']
+            print(f"{report['requests']} requests ({report['errors']} failed) in {report['elapsed']:.3f}s: {report['throughput']:.1f} req/s")
+            print(f"Request latency: p50={rl['p50'] * 1000:.2f}ms p95={rl['p95'] * 1000:.2f}ms p99={rl['p99'] * 1000:.2f}ms")
+            print(f"Cache: {report['cached']} hits for {report['repeats']} repeated prompts")
+            print(json.dumps(report['accounting'], indent=2))
+
+    elif args.command == 'startup':
+        report = run_startup(args.runs)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"Cold start over {report['runs']} runs (median): import {report['median_import'] * 1000:.1f}ms, "
+                  f"ready {report['median_ready'] * 1000:.1f}ms, process {report['median_process_wall'] * 1000:.1f}ms")
+            print(f"Modules loaded at ready: {report['modules_at_ready']}, tool schema: {report['schema_bytes']} bytes")
+            for name, t in report['first_resolve'].items():
+                print(f"First dispatch import of {name}: " + (f'{t * 1000:.1f}ms' if isinstance(t, float) else t))
+
+    elif args.command == 'serialize':
+        report = run_serialize(args.tool_calls, args.iterations)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            for name, timings in report['results'].items():
+                print(f'{name}: ' + ', '.join(f'{k} {v * 1e6:.1f}us' for k, v in timings.items()))
+
+    elif args.command == 'views':
+        report = run_views(args.tool_calls, args.iterations)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print(f"Nested access with {report['tool_calls']} tool calls: "
+                  f"copying MagicDict {report['legacy_magic_dict'] * 1e6:.2f}us, views {report['magic_dict_views'] * 1e6:.2f}us")
+
+    elif args.command == '_startup_child':
+        _startup_child()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
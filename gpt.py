@@ -1,26 +1,118 @@
-from typing import Any
+from typing import Any, Optional, Callable, Awaitable, Deque, Dict, List, Tuple
+from collections import defaultdict, deque
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import contextvars
+import functools
 import hashlib
+import logging
 import ujson as json
 import sqlite3
 import time
 import asyncio
+import random
+import re
 import openai
 
+from servant.base.metrics import LatencyHistogram, format_labels
+from servant.base.json import FrozenJSONArray, dumps_bytes, loads as json_loads, obj_to_json, register_encoder
+
 from textwrap import indent, dedent
 
+_LOGGER = logging.getLogger(__name__)
+
+class JSONView(MutableMapping):
+    # Attribute access over a nested dict without copying it. Reads and writes go to the wrapped
+    # dict; views of child dicts are created once and cached. Lists are returned as they are.
+    __slots__ = ('_data', '_views')
+
+    def __init__(self, data: dict):
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_views', {})
+
+    def __getattribute__(self, key):
+        # Keys are looked up before attributes (except the Mapping API), which avoids going through
+        # a failed attribute lookup and __getattr__ on every access
+        if key not in _JSONVIEW_ATTRIBUTES:
+            data = object.__getattribute__(self, '_data')
+            if key in data:
+                return _wrap(object.__getattribute__(self, '_views'), key, data[key])
+        return object.__getattribute__(self, key)
+
+    def __getattr__(self, key):
+        raise AttributeError(key)
+
+    def __getitem__(self, key):
+        return _wrap(self._views, key, self._data[key])
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+
+    def __setattr__(self, key, value):
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __delattr__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def to_dict(self) -> dict:
+        return self._data
+
+    def __reduce__(self):
+        return (JSONView, (self._data,))
+
+    def __repr__(self):
+        return f'JSONView({self._data!r})'
+
+
+_JSONVIEW_ATTRIBUTES = frozenset(dir(JSONView))
+
+
+def _wrap(views: dict, key, value):
+    if type(value) is not dict:
+        return value
+    view = views.get(key)
+    if view is None or view._data is not value:
+        view = JSONView(value)
+        views[key] = view
+    return view
+
+
+register_encoder(JSONView, lambda view, emit_null: obj_to_json(view.to_dict(), emit_null))
+
+
 class MagicDict(dict):
-    # implements __getattr__ and __setattr__ for a dictionary
+    # implements __getattr__ and __setattr__ for a dictionary; nested dicts are returned as
+    # (cached, non-copying) JSONViews
+    def __getattribute__(self, key):
+        if key not in _MAGICDICT_ATTRIBUTES and dict.__contains__(self, key):
+            return _wrap(self._views, key, dict.__getitem__(self, key))
+        return object.__getattribute__(self, key)
+
     def __getattr__(self, key):
-        r = self[key]
-        if isinstance(r, dict) and not isinstance(r, MagicDict):
-            return MagicDict(r)
-        return r
+        if key == '_views':
+            views = {}
+            self.__dict__['_views'] = views
+            return views
+        if key.startswith('__'):
+            # Protocol lookups (copy, pickle) must see a missing attribute, not a missing key
+            raise AttributeError(key)
+        return self[key]
 
     def __getitem__(self, key):
-        r = super().__getitem__(key)
-        if isinstance(r, dict) and not isinstance(r, MagicDict):
-            return MagicDict(r)
-        return r
+        return _wrap(self._views, key, super().__getitem__(key))
 
     def __setattr__(self, key, value):
         self[key] = value
@@ -31,20 +123,136 @@ class MagicDict(dict):
     def __repr__(self):
         return f'MagicDict({super().__repr__()})'
 
+    def __reduce__(self):
+        # Without the cached views
+        return (MagicDict, (dict(self),))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-def obj_to_dict(obj, emit_null=True):
-    if isinstance(obj, list):
-        return [obj_to_dict(o) for o in obj]
-    elif isinstance(obj, dict):
-        return {k: obj_to_dict(v) for k, v in obj.items() if emit_null or v is not None}
-    elif isinstance(obj, int) or isinstance(obj, float) or isinstance(obj, str) or isinstance(obj, bool) or obj is None:
-        return obj
-    else:
-        return obj_to_dict(obj.__dict__)
+
+_MAGICDICT_ATTRIBUTES = frozenset(dir(MagicDict)) | {'_views', '__dict__'}
+
+class ChatResponse(Mapping):
+    # Chat completion as it travels through the backend chain. Holds the JSON body exactly as it came
+    # from the API (or the cache) and decodes it once, on first access; a cache stores and loads the
+    # body without re-serializing it. Timing and cache status live in slots, not in the payload.
+    # Nested values are JSONViews, as with MagicDict. Setting a top-level key re-encodes on
+    # to_bytes(); edits to nested values are not written back to the raw body.
+    __slots__ = ('_raw', '_data', '_views', 'timing', 'cached')
+
+    def __init__(self, raw: Optional[bytes | str] = None, data: Optional[dict] = None,
+                 timing: Optional[dict] = None, cached: bool = False):
+        assert raw is not None or data is not None
+        object.__setattr__(self, '_raw', raw)
+        object.__setattr__(self, '_data', data)
+        object.__setattr__(self, '_views', {})
+        object.__setattr__(self, 'timing', timing)
+        object.__setattr__(self, 'cached', cached)
+
+    @classmethod
+    def from_bytes(cls, raw: bytes | str, timing: Optional[dict] = None, cached: bool = False) -> 'ChatResponse':
+        return cls(raw=raw, timing=timing, cached=cached)
+
+    @classmethod
+    def from_dict(cls, data: dict, timing: Optional[dict] = None, cached: bool = False) -> 'ChatResponse':
+        return cls(data=_normalize_response(data), timing=timing, cached=cached)
+
+    def _decoded(self) -> dict:
+        data = object.__getattribute__(self, '_data')
+        if data is None:
+            data = _normalize_response(json_loads(self._raw))
+            object.__setattr__(self, '_data', data)
+        return data
+
+    def __getattribute__(self, key):
+        if key not in _CHATRESPONSE_ATTRIBUTES:
+            data = object.__getattribute__(self, '_decoded')()
+            if key in data:
+                return _wrap(object.__getattribute__(self, '_views'), key, data[key])
+        return object.__getattribute__(self, key)
+
+    def __getattr__(self, key):
+        raise AttributeError(key)
+
+    def __getitem__(self, key):
+        # The legacy in-band fields map onto the slots
+        if key == ChatBackend.TIMING_FIELD:
+            if self.timing is None:
+                raise KeyError(key)
+            return self.timing
+        if key == ChatBackend.CACHED_FIELD:
+            return self.cached
+        return _wrap(self._views, key, self._decoded()[key])
+
+    def __setitem__(self, key, value):
+        if key == ChatBackend.TIMING_FIELD:
+            object.__setattr__(self, 'timing', value)
+        elif key == ChatBackend.CACHED_FIELD:
+            object.__setattr__(self, 'cached', bool(value))
+        else:
+            self._decoded()[key] = value
+            object.__setattr__(self, '_raw', None)
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def __contains__(self, key):
+        if key == ChatBackend.TIMING_FIELD:
+            return self.timing is not None
+        return key in self._decoded()
+
+    def to_bytes(self) -> bytes | str:
+        # The JSON body for a cache; the original bytes unless a top-level key was replaced
+        if self._raw is None:
+            object.__setattr__(self, '_raw', dumps_bytes(self._data))
+        return self._raw
+
+    def to_text(self) -> str:
+        # For TEXT columns; one UTF-8 decode of the body, no JSON work
+        raw = self.to_bytes()
+        return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+
+    def to_dict(self) -> dict:
+        return self._decoded()
+
+    def __reduce__(self):
+        return (ChatResponse, (self.to_bytes(), None, self.timing, self.cached))
+
+    def __repr__(self):
+        return f'ChatResponse({self._decoded()!r}, cached={self.cached})'
+
+
+_CHATRESPONSE_ATTRIBUTES = frozenset(dir(ChatResponse))
+
+
+def _normalize_response(data: dict) -> dict:
+    # Rows cached before ChatResponse carry timing and cache status in-band; the API sends explicit
+    # nulls for absent function/tool calls
+    data.pop('__timing__', None)
+    data.pop('__cached__', None)
+    for choice in data.get('choices') or ():
+        message = choice.get('message')
+        if message is not None:
+            for key in ('function_call', 'tool_calls'):
+                if key in message and message[key] is None:
+                    del message[key]
+    return data
+
+
+register_encoder(ChatResponse, lambda response, emit_null: obj_to_json(response.to_dict(), emit_null))
+
+# OpenAI response objects are pydantic models; obj_to_json has a fast path for them
+obj_to_dict = obj_to_json
 
 def json_hash(obj: Any) -> str:
+    # Top-level values with a precomputed hash (e.g. the tools schema snapshot) are hashed by reference
+    # instead of being re-serialized on every request.
+    if isinstance(obj, dict):
+        obj = {k: {'__hash__': v.hash} if isinstance(v, FrozenJSONArray) else v for k, v in obj.items()}
     request = json.dumps(obj, sort_keys=True)
     return hashlib.sha256(request.encode('utf-8')).hexdigest()
 
@@ -56,13 +264,21 @@ class ChatBackend:
     async def async_request(self, **kwargs): ...
 
     TIMING_FIELD = '__timing__'
+    CACHED_FIELD = '__cached__'
 
 
 class ChatSqliteCache(ChatBackend):
+    # Prefixed to every request hash; bump it whenever json_hash changes how a request maps to a
+    # key, so old entries visibly stop matching instead of silently missing.
+    #   v2: the tools array is hashed by its snapshot hash (FrozenJSONArray), not by its content
+    KEY_VERSION = 2
+
     def __init__(self, backend: ChatBackend, db_path: str, table_name: str = 'chat_cache'):
         self.backend = backend
         self.table_name = table_name
-        self.conn = sqlite3.connect(db_path)
+        # May be shared by several bot processes (sharding): WAL, and wait for other writers
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
         self.cursor = self.conn.cursor()
 
         self.cursor.execute(f'''
@@ -75,25 +291,190 @@ class ChatSqliteCache(ChatBackend):
             )
         ''')
 
-    async def async_request(self, **kwargs) -> MagicDict:
-        request_hash = json_hash(kwargs)
+    async def async_request(self, **kwargs) -> ChatResponse:
+        request_hash = f'v{self.KEY_VERSION}:{json_hash(kwargs)}'
         self.cursor.execute('SELECT response FROM chat_cache WHERE request_hash=?', (request_hash,))
         result = self.cursor.fetchone()
         if result is not None:
-            print(kwargs)
-            return MagicDict(json.loads(result[0]))
+            return ChatResponse.from_bytes(result[0], cached=True)
 
         t0 = time.time()
         response = await self.backend.async_request(**kwargs)
         t1 = time.time()
 
-        self.cursor.execute('INSERT INTO chat_cache VALUES (?, ?, ?, ?, ?)',
-            (request_hash, json.dumps(kwargs), t0, t1, json.dumps(response)))
+        self.cursor.execute('INSERT OR REPLACE INTO chat_cache VALUES (?, ?, ?, ?, ?)',
+            (request_hash, json.dumps(kwargs), t0, t1, response.to_text()))
         self.conn.commit()
 
         return response
 
 
+@dataclass
+class SemanticCacheRule:
+    # Requests whose last user message matches `pattern` are considered stateless and may be
+    # answered from the semantic cache for `ttl` seconds.
+    name: str
+    pattern: str
+    ttl: float
+
+
+DEFAULT_SEMANTIC_CACHE_RULES = [
+    SemanticCacheRule('weather', r'\b(weather|temperature|forecast|raining|snowing|sunny)\b', ttl=15 * 60),
+    SemanticCacheRule('faq', r'^\W*(what is|what are|what does|who is|who was|who were|define|explain)\b', ttl=7 * 24 * 3600),
+]
+
+_USER_PREFIX_RE = re.compile(r'^Message from [^:]*:\s*')
+
+
+@functools.lru_cache(maxsize=64)
+def _address_re(personality: str) -> re.Pattern:
+    from servant.base.triggers import TriggerMatcher
+
+    names = '|'.join(re.escape(t) for t in sorted(TriggerMatcher.triggers_for(personality), key=len, reverse=True))
+    return re.compile(r'^\W*(?:(?:hey|hi|ok|okay|so)\s+)?(?:' + names + r')\b[,:;!.]?\s+', re.IGNORECASE)
+
+
+def _strip_address(text: str, personality: str) -> str:
+    # Addressed messages start with the trigger ("Jeeves, what is ..."); the question follows it
+    return _address_re(personality).sub('', text, count=1) if personality else text
+
+
+class ChatSemanticCache(ChatBackend):
+    # Answers near-duplicate stateless questions from earlier responses. The last user message is
+    # embedded locally (hashed n-grams, no model download) into an on-disk LSH vector index; a hit
+    # needs cosine similarity >= `threshold`, the same non-stopword terms, the same namespace
+    # (model + personality) and an unexpired entry of the same rule.
+    # The sqlite and vector file work runs on a private thread, off the event loop.
+
+    def __init__(self, backend: ChatBackend, db_path: str, vectors_path: Optional[str] = None,
+                 rules: List[SemanticCacheRule] = DEFAULT_SEMANTIC_CACHE_RULES, threshold: float = 0.7,
+                 table_name: str = 'semantic_cache'):
+        from servant.base.embedding import HashedNgramEmbedder, VectorIndex
+
+        self.backend = backend
+        self.rules = [(rule, re.compile(rule.pattern, re.IGNORECASE)) for rule in rules]
+        self.threshold = threshold
+        self.table_name = table_name
+        self.embedder = HashedNgramEmbedder()
+        self.index = VectorIndex(vectors_path or db_path + '.vectors', self.embedder.dim)
+        self.hits = 0
+        self.misses = 0
+
+        # Only used from the executor thread after construction
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='semantic-cache')
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                row INTEGER PRIMARY KEY,
+                namespace TEXT,
+                rule TEXT,
+                query TEXT,
+                terms TEXT,
+                created_time REAL,
+                response TEXT
+            )
+        ''')
+
+    def _rule(self, text: str) -> Optional[SemanticCacheRule]:
+        for rule, pattern in self.rules:
+            if pattern.search(text):
+                return rule
+        return None
+
+    @staticmethod
+    def _last_user_text(messages: List[dict]) -> Optional[str]:
+        for message in reversed(messages):
+            if message.get('role') == 'user':
+                content = message.get('content')
+                if not isinstance(content, str):
+                    return None
+                return _strip_address(_USER_PREFIX_RE.sub('', content), _ACCOUNTING_LABELS.get().get('personality', ''))
+        return None
+
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args))
+
+    @staticmethod
+    def _namespace(kwargs: dict) -> str:
+        return f"{kwargs.get('model', '')}/{_ACCOUNTING_LABELS.get().get('personality', '')}"
+
+    def lookup(self, text: str, namespace: str, rule: SemanticCacheRule) -> Optional[ChatResponse]:
+        from servant.base.embedding import content_words
+
+        terms = ' '.join(sorted(content_words(text)))
+        now = time.time()
+        for row, score in self.index.search(self.embedder.embed(text), k=8, min_score=self.threshold):
+            self.cursor.execute(f'SELECT namespace, rule, terms, created_time, response FROM {self.table_name} WHERE row=?', (row,))
+            entry = self.cursor.fetchone()
+            if entry is None:
+                continue
+            entry_namespace, entry_rule, entry_terms, created_time, response = entry
+            if entry_namespace == namespace and entry_rule == rule.name and entry_terms == terms and now - created_time <= rule.ttl:
+                return ChatResponse.from_bytes(response, cached=True)
+        return None
+
+    def store(self, text: str, namespace: str, rule: SemanticCacheRule, response: ChatResponse) -> None:
+        from servant.base.embedding import content_words
+
+        row = self.index.add(self.embedder.embed(text))
+        self.cursor.execute(f'INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (row, namespace, rule.name, text, ' '.join(sorted(content_words(text))), time.time(), response.to_text()))
+        self.conn.commit()
+
+    async def async_request(self, **kwargs) -> ChatResponse:
+        messages = kwargs.get('messages', [])
+        text = self._last_user_text(messages)
+        rule = self._rule(text) if text else None
+        if rule is None:
+            return await self.backend.async_request(**kwargs)
+
+        namespace = self._namespace(kwargs)
+
+        # Only the opening request of an exchange (ending with the user's message) can be answered
+        # from the cache; follow-up requests carry tool results for this specific question.
+        if messages[-1].get('role') == 'user':
+            cached = await self._run(self.lookup, text, namespace, rule)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        response = await self.backend.async_request(**kwargs)
+
+        if response.choices[0]['finish_reason'] == 'stop' and not response.cached:
+            await self._run(self.store, text, namespace, rule, response)
+        return response
+
+
+# USD per 1M tokens (input, output). Looked up by longest model-name prefix, so dated
+# snapshots like "gpt-4o-2024-05-13" resolve to their family.
+MODEL_PRICING: Dict[str, Tuple[float, float]] = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (5.00, 15.00),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4-1106-preview': (10.00, 30.00),
+    'gpt-4-0125-preview': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+
+def model_pricing(model: str) -> Optional[Tuple[float, float]]:
+    best = None
+    for prefix in MODEL_PRICING:
+        if model.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return MODEL_PRICING[best] if best is not None else None
+
+
+# Labels (e.g. channel, personality) attributed to requests made from the current task.
+_ACCOUNTING_LABELS: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar('accounting_labels', default={})
+
+def set_accounting_labels(**labels: str) -> contextvars.Token:
+    return _ACCOUNTING_LABELS.set(labels)
+
+
 class ChatAccounting(ChatBackend):
     total_request_count: int = 0
     total_request_time: float = 0
@@ -103,52 +484,261 @@ class ChatAccounting(ChatBackend):
 
     def __init__(self, backend: ChatBackend):
         self.backend = backend
+        self.total_cached_count = 0
+        self.model_requests: Dict[str, int] = defaultdict(int)
+        self.model_tokens: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.model_cost: Dict[str, float] = defaultdict(float)
+        self.label_tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        # Request latency of fresh (uncached) responses per model. Requests are not streamed, so
+        # there is no time-to-first-token to report.
+        self.latency: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
 
     async def async_request(self, **kwargs):
+        t0 = time.perf_counter()
         response = await self.backend.async_request(**kwargs)
+        total_time = time.perf_counter() - t0
 
         assert 'usage' in response
         prompt_tokens = response.usage.prompt_tokens
         completion_tokens = response.usage.completion_tokens
-
-        assert ChatBackend.TIMING_FIELD in response
-        start = response[ChatBackend.TIMING_FIELD].start
-        end = response[ChatBackend.TIMING_FIELD].end
+        model = response.get('model') or kwargs.get('model') or 'unknown'
+        cached = response.cached
 
         self.total_request_count += 1
+        self.total_request_time += total_time
+        self.model_requests[model] += 1
+
+        # Cache hits would drag the percentiles down
+        if cached:
+            self.total_cached_count += 1
+            return response
+
+        self.latency[model].observe(total_time)
         self.total_input_tokens += prompt_tokens
         self.total_output_tokens += completion_tokens
-        self.total_request_time += start - end
-        self.total_request_cost += prompt_tokens * 0.01 / 1000.0 + completion_tokens * 0.03 / 1000.0
+        self.model_tokens[(model, 'input')] += prompt_tokens
+        self.model_tokens[(model, 'output')] += completion_tokens
+
+        pricing = model_pricing(model)
+        if pricing is not None:
+            cost = (prompt_tokens * pricing[0] + completion_tokens * pricing[1]) / 1_000_000.0
+            self.total_request_cost += cost
+            self.model_cost[model] += cost
+
+        for label, value in _ACCOUNTING_LABELS.get().items():
+            self.label_tokens[(label, value, 'input')] += prompt_tokens
+            self.label_tokens[(label, value, 'output')] += completion_tokens
 
         return response
 
+    def to_json(self):
+        return {
+            'total_request_count': self.total_request_count,
+            'total_cached_count': self.total_cached_count,
+            'total_request_time': self.total_request_time,
+            'total_request_cost': self.total_request_cost,
+            'total_input_tokens': self.total_input_tokens,
+            'total_output_tokens': self.total_output_tokens,
+            'latency': {model: h.to_json() for model, h in self.latency.items()}
+        }
+
+    def prometheus_metrics(self) -> List[str]:
+        lines = ['# TYPE jeeves_chat_requests_total counter']
+        for model, count in self.model_requests.items():
+            lines.append(f'jeeves_chat_requests_total{format_labels({"model": model})} {count}')
+        lines.append('# TYPE jeeves_chat_cached_requests_total counter')
+        lines.append(f'jeeves_chat_cached_requests_total {self.total_cached_count}')
+
+        lines.append('# TYPE jeeves_chat_tokens_total counter')
+        for (model, direction), count in self.model_tokens.items():
+            lines.append(f'jeeves_chat_tokens_total{format_labels({"model": model, "direction": direction})} {count}')
+
+        lines.append('# TYPE jeeves_chat_cost_dollars_total counter')
+        for model, cost in self.model_cost.items():
+            lines.append(f'jeeves_chat_cost_dollars_total{format_labels({"model": model})} {cost}')
+
+        lines.append('# TYPE jeeves_chat_label_tokens_total counter')
+        for (label, value, direction), count in self.label_tokens.items():
+            lines.append(f'jeeves_chat_label_tokens_total{format_labels({"label": label, "value": value, "direction": direction})} {count}')
+
+        lines.append('# TYPE jeeves_chat_latency_seconds summary')
+        for model, histogram in self.latency.items():
+            lines.extend(histogram.to_prometheus('jeeves_chat_latency_seconds', {'model': model}))
+        return lines
+
+
+def _parse_duration(value: str | None) -> Optional[float]:
+    # Parses OpenAI-style durations ("1s", "6m0s", "20ms", "0.5") into seconds.
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value):
+        total += float(amount) * {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}[unit]
+        matched = True
+    return total if matched else None
+
+
+def _retry_after(headers) -> Optional[float]:
+    if headers is None:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000.0
+        except ValueError:
+            pass
+    return _parse_duration(headers.get('retry-after'))
+
+
+class AdaptiveRateController:
+    # Shared across all requests of a backend:
+    #  * AIMD concurrency limit: +1/limit per success, halved on 429/5xx.
+    #  * Server hints (Retry-After, x-ratelimit-remaining-*/reset-*) pause all requests, not just the failing one.
+    #  * A retry budget that is refilled by successes, so retries can't snowball under sustained failure.
+
+    def __init__(self, initial_limit: float = 8, min_limit: float = 1, max_limit: float = 64,
+                 retry_budget: float = 10, retry_refill: float = 0.1,
+                 backoff_base: float = 1.0, backoff_cap: float = 60.0):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.paused_until = 0.0
+
+        self.retry_budget_max = retry_budget
+        self.retry_budget = retry_budget
+        self.retry_refill = retry_refill
+
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        # Requests waiting for a slot, woken in order as slots free up
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        # On return the caller holds a slot and must release() it; a cancelled acquire holds none
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.cancelled():
+                    self._waiters.remove(waiter)
+                else:
+                    # Woken but cancelled before taking the slot: pass the wake-up on
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self) -> None:
+        # Synchronous, so a release in a `finally` can't be interrupted by cancellation
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self, headers=None) -> None:
+        self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self.retry_budget = min(self.retry_budget_max, self.retry_budget + self.retry_refill)
+        self._wake()
+
+        if headers is not None:
+            for kind in ('requests', 'tokens'):
+                remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+                if remaining is not None and remaining.isdigit() and int(remaining) == 0:
+                    reset = _parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                    if reset is not None:
+                        self.pause(reset)
+
+    def on_overload(self, retry_after: Optional[float] = None) -> None:
+        self.limit = max(self.min_limit, self.limit / 2)
+        if retry_after is not None:
+            self.pause(retry_after)
+
+    def take_retry(self) -> bool:
+        if self.retry_budget < 1.0:
+            return False
+        self.retry_budget -= 1.0
+        return True
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # Full jitter, but never earlier than the server asked us to.
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code == 408 or e.status_code >= 500
+    return False
+
 
 class ChatOpenAI(ChatBackend):
-    def __init__(self, openai_client: openai.AsyncOpenAI, defaults: dict = {}):
+    def __init__(self, openai_client: openai.AsyncOpenAI, defaults: dict = {}, rate_limiter: Optional[Callable[[], Awaitable[None]]] = None,
+                 controller: Optional[AdaptiveRateController] = None, max_retries: int = 10):
         self.openai_client = openai_client
         self.defaults = defaults
+        self.rate_limiter = rate_limiter
+        self.controller = controller if controller is not None else AdaptiveRateController()
+        self.max_retries = max_retries
 
-    async def async_request(self, **kwargs) -> MagicDict:
+    async def async_request(self, **kwargs) -> ChatResponse:
         for k, v in self.defaults.items():
             kwargs.setdefault(k, v)
 
         retry_count = 0
         while True:
+            await self.controller.acquire()
             try:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter()
                 t0 = time.time()
-                response = await self.openai_client.chat.completions.create(**kwargs)
+                raw_response = await self.openai_client.chat.completions.with_raw_response.create(**kwargs)
                 t1 = time.time()
+                # The body is kept as bytes; ChatResponse decodes it on first access
+                body = raw_response.content
+                self.controller.on_success(raw_response.headers)
                 break
-            except KeyboardInterrupt:
-                raise
-            except BaseException as e:
-                import traceback
-                if retry_count >= 10: raise
-                print(f"OpenAI API Error (retrying in 5s): {type(e)}: {e}")
-                # traceback.print_exc()
-                import random
-                await asyncio.sleep(5 * 1.5 ** retry_count + 5 * random.random())
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+
+                retry_after = _retry_after(e.response.headers) if isinstance(e, openai.APIStatusError) else None
+                if isinstance(e, openai.APIStatusError):
+                    self.controller.on_overload(retry_after)
+
+                if retry_count >= self.max_retries or not self.controller.take_retry():
+                    raise
+
+                delay = self.controller.backoff(retry_count, retry_after)
+                _LOGGER.warning(f"OpenAI API Error (retrying in {delay:.1f}s, concurrency limit {int(self.controller.limit)}): {type(e)}: {e}")
                 retry_count += 1
 
                 # OpenAI API Error (retrying in 5s): <class 'openai.error.APIError'>: HTTP code 502 from API (<html>
@@ -159,18 +749,12 @@ class ChatOpenAI(ChatBackend):
                 # </body>
                 # </html>
                 # )
+            finally:
+                self.controller.release()
 
-        result = obj_to_dict(response, emit_null=False)
-        result[ChatBackend.TIMING_FIELD] = { 'start': t0, 'end': t1 }
+            await asyncio.sleep(delay)
 
-        for choice in result['choices']:
-            message = choice['message']
-            if 'function_call' in message and message['function_call'] is None:
-                del message['function_call']
-            if 'tool_calls' in message and message['tool_calls'] is None:
-                del message['tool_calls']
-
-        return MagicDict(result)
+        return ChatResponse.from_bytes(body, timing={ 'start': t0, 'end': t1 })
 
 
 class ChatWithDefaults(ChatBackend):
@@ -178,8 +762,242 @@ class ChatWithDefaults(ChatBackend):
         self.backend = backend
         self.defaults = defaults
 
-    async def async_request(self, **kwargs) -> MagicDict:
+    async def async_request(self, **kwargs) -> ChatResponse:
         for k, v in self.defaults.items():
             kwargs.setdefault(k, v)
 
         return await self.backend.async_request(**kwargs)
+
+
+def _finished(response: ChatResponse) -> bool:
+    # Truncated or filtered answers lose the race
+    return response.choices[0]['finish_reason'] in ('stop', 'tool_calls')
+
+
+class ChatRace(ChatBackend):
+    # Sends one request to several backends (providers, or one ChatOpenAI per model; sharing one would
+    # put every model behind the same concurrency limit, retry budget and rate limiter) and returns
+    # the first response accepted by `accept`; the others are cancelled.
+    # Without a hedge policy all backends start at once. With `hedge_quantile` (e.g. 0.95) the next
+    # backend only starts once the current one has taken longer than that quantile of its recent
+    # latencies (`hedge_delay` until `min_samples` are known), or as soon as it fails.
+    # Racing applies to the channels in `channels` (the accounting label), or everywhere if None;
+    # other requests go to the first backend only. Cancelled requests are not seen by ChatAccounting.
+
+    def __init__(self, backends: List[ChatBackend], names: Optional[List[str]] = None,
+                 hedge_delay: Optional[float] = None, hedge_quantile: Optional[float] = None, min_samples: int = 20,
+                 accept: Callable[[ChatResponse], bool] = _finished, channels: Optional[List[str]] = None):
+        assert len(backends) > 0
+        self.backends = backends
+        self.names = names if names is not None else [f'backend{i}' for i in range(len(backends))]
+        assert len(self.names) == len(backends)
+        self.hedge_delay = hedge_delay
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.accept = accept
+        self.channels = set(channels) if channels is not None else None
+        self.latency: List[LatencyHistogram] = [LatencyHistogram() for _ in backends]
+        self.wins: Dict[str, int] = defaultdict(int)
+        self.started: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, int] = defaultdict(int)
+        self.cancelled: Dict[str, int] = defaultdict(int)
+
+    def delay(self, index: int) -> Optional[float]:
+        # How long backend `index` gets before the next one is started; None starts it right away
+        if self.hedge_quantile is not None and self.latency[index].count >= self.min_samples:
+            return self.latency[index].percentile(self.hedge_quantile)
+        return self.hedge_delay
+
+    async def _attempt(self, index: int, kwargs: dict) -> ChatResponse:
+        t0 = time.perf_counter()
+        try:
+            response = await self.backends[index].async_request(**kwargs)
+        except asyncio.CancelledError:
+            # Censored sample: the attempt took at least this long. Leaving losers out would bias
+            # the quantile low and make hedges fire more and more often.
+            self.latency[index].observe(time.perf_counter() - t0)
+            raise
+        # Cache hits say nothing about the backend's latency
+        if not response.cached:
+            self.latency[index].observe(time.perf_counter() - t0)
+        return response
+
+    async def async_request(self, **kwargs) -> ChatResponse:
+        if self.channels is not None and _ACCOUNTING_LABELS.get().get('channel') not in self.channels:
+            return await self.backends[0].async_request(**kwargs)
+
+        pending: Dict[asyncio.Task, int] = {}
+        fallback: Optional[ChatResponse] = None
+        error: Optional[BaseException] = None
+        next_index = 0
+
+        def start_next() -> None:
+            nonlocal next_index
+            name = self.names[next_index]
+            self.started[name] += 1
+            pending[asyncio.ensure_future(self._attempt(next_index, dict(kwargs)))] = next_index
+            next_index += 1
+
+        try:
+            start_next()
+            while pending:
+                timeout = None
+                if next_index < len(self.backends):
+                    timeout = self.delay(next_index - 1)
+                    if timeout is None:
+                        start_next()
+                        continue
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Hedge: the latest backend is slower than usual
+                    start_next()
+                    continue
+
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is not None:
+                        error = task.exception()
+                        _LOGGER.warning(f'{self.names[index]} failed in race: {type(error).__name__}: {error}')
+                    elif self.accept(task.result()):
+                        self.wins[self.names[index]] += 1
+                        return task.result()
+                    else:
+                        self.rejected[self.names[index]] += 1
+                        if fallback is None:
+                            fallback = task.result()
+
+                # Nothing usable from the finished ones; don't wait out the delay for the next backend
+                if not pending and next_index < len(self.backends):
+                    start_next()
+        finally:
+            for task, index in pending.items():
+                task.cancel()
+                self.cancelled[self.names[index]] += 1
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # No backend gave an acceptable answer: the first complete one, else the last error
+        if fallback is not None:
+            return fallback
+        assert error is not None
+        raise error
+
+    def to_json(self):
+        return {
+            name: {
+                'started': self.started[name],
+                'wins': self.wins[name],
+                'rejected': self.rejected[name],
+                'cancelled': self.cancelled[name],
+                'latency': latency.to_json()
+            }
+            for name, latency in zip(self.names, self.latency)
+        }
+
+    def prometheus_metrics(self) -> List[str]:
+        lines = []
+        for metric, counts in (('started', self.started), ('wins', self.wins), ('rejected', self.rejected), ('cancelled', self.cancelled)):
+            lines.append(f'# TYPE jeeves_race_{metric}_total counter')
+            for name in self.names:
+                lines.append(f'jeeves_race_{metric}_total{format_labels({"backend": name})} {counts[name]}')
+        lines.append('# TYPE jeeves_race_latency_seconds summary')
+        for name, latency in zip(self.names, self.latency):
+            lines.extend(latency.to_prometheus('jeeves_race_latency_seconds', {'backend': name}))
+        return lines
+
+
+def estimate_tokens(obj: Any) -> int:
+    # Rough 4-characters-per-token estimate, good enough for synthetic usage numbers.
+    return max(1, len(json.dumps(obj)) // 4)
+
+
+def mock_completion(spec: str | dict, model: str = 'mock', prompt_tokens: int = 0, completion_id: str = 'chatcmpl-mock') -> dict:
+    # Builds a chat.completion payload from a script entry:
+    #   "text"                                               -> plain assistant reply
+    #   {"content": "...", "tool_calls": [{"name": ..., "arguments": {...}}]} -> tool calls
+    if isinstance(spec, str):
+        spec = {'content': spec}
+
+    message = {'role': 'assistant', 'content': spec.get('content')}
+    finish_reason = spec.get('finish_reason', 'stop')
+    if spec.get('tool_calls'):
+        message['tool_calls'] = [
+            {
+                'id': call.get('id', f'call_{i}'),
+                'type': 'function',
+                'function': {
+                    'name': call['name'],
+                    'arguments': call['arguments'] if isinstance(call['arguments'], str) else json.dumps(call['arguments'])
+                }
+            }
+            for i, call in enumerate(spec['tool_calls'])
+        ]
+        finish_reason = spec.get('finish_reason', 'tool_calls')
+
+    completion_tokens = estimate_tokens(message)
+    return {
+        'id': completion_id,
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+
+class MockScript:
+    # Deterministic response source shared by ChatMock and the openai_stub server.
+    # `script` is either a list of entries served in order (then falling back to echoing the last
+    # user message) or a callable mapping the request kwargs to an entry.
+
+    def __init__(self, script: List[str | dict] | Callable[[dict], str | dict] | None = None):
+        self.script = script
+        self.position = 0
+
+    def next(self, request: dict) -> str | dict:
+        if callable(self.script):
+            return self.script(request)
+        if self.script is not None and self.position < len(self.script):
+            entry = self.script[self.position]
+            self.position += 1
+            return entry
+
+        for message in reversed(request.get('messages', [])):
+            if message.get('role') == 'user':
+                return f"Mock response to: {message.get('content')}"
+        return 'Mock response.'
+
+
+class ChatMock(ChatBackend):
+    # Offline stand-in for ChatOpenAI with scripted responses, latency and error injection.
+    # `latency` is seconds or a callable returning seconds; errors are raised as openai.APIConnectionError
+    # so callers see the same exception type as a network failure.
+
+    def __init__(self, script: List[str | dict] | Callable[[dict], str | dict] | None = None,
+                 latency: float | Callable[[], float] = 0.0, error_rate: float = 0.0, seed: int = 0, model: str = 'mock'):
+        self.script = MockScript(script)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.model = model
+        self.request_count = 0
+
+    async def async_request(self, **kwargs) -> ChatResponse:
+        self.request_count += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+
+        t0 = time.time()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            import httpx
+            raise openai.APIConnectionError(message='Injected mock error', request=httpx.Request('POST', 'http://mock/v1/chat/completions'))
+        t1 = time.time()
+
+        result = mock_completion(
+            self.script.next(kwargs),
+            model=kwargs.get('model', self.model),
+            prompt_tokens=estimate_tokens(kwargs.get('messages', [])),
+            completion_id=f'chatcmpl-mock-{self.request_count}')
+        return ChatResponse.from_dict(result, timing={ 'start': t0, 'end': t1 })
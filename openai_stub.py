@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Local OpenAI-compatible chat-completions server for offline load testing.
+#
+#   python openai_stub.py --port 8088 --latency 0.2 --error-rate 0.05 --script script.json
+#
+# Point the real client at it to exercise ChatOpenAI's retry/backoff, caching and accounting:
+#   openai.AsyncOpenAI(base_url='http://127.0.0.1:8088/v1', api_key='stub')
+#
+# script.json is a list of entries understood by gpt.mock_completion, served in order:
+#   ["Hello!", {"tool_calls": [{"name": "get_current_weather", "arguments": {"location": {...}}}]}]
+from typing import List, Optional
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+
+from aiohttp import web
+
+from gpt import MockScript, mock_completion, estimate_tokens
+
+_logger = logging.getLogger(__name__)
+
+
+class StubServer:
+    def __init__(self, script: MockScript, latency: float = 0.0, latency_jitter: float = 0.0,
+                 error_rate: float = 0.0, error_statuses: List[int] = [429, 500, 503], retry_after: Optional[float] = 1.0,
+                 stream_chunk_delay: float = 0.0, seed: int = 0):
+        self.script = script
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.retry_after = retry_after
+        self.stream_chunk_delay = stream_chunk_delay
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.error_count = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.chat_completions)
+        app.router.add_get('/v1/models', self.models)
+        return app
+
+    async def models(self, request: web.Request) -> web.Response:
+        return web.json_response({'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'stub'}]})
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.request_count += 1
+        completion_id = f'chatcmpl-stub-{self.request_count}'
+
+        delay = self.latency + self.random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self.error_rate > 0 and self.random.random() < self.error_rate:
+            self.error_count += 1
+            status = self.random.choice(self.error_statuses)
+            headers = {}
+            if status == 429 and self.retry_after is not None:
+                headers['retry-after'] = str(self.retry_after)
+            return web.json_response(
+                {'error': {'message': f'Injected error {status}', 'type': 'stub_error', 'code': status}},
+                status=status, headers=headers)
+
+        completion = mock_completion(
+            self.script.next(body),
+            model=body.get('model', 'mock'),
+            prompt_tokens=estimate_tokens(body.get('messages', [])),
+            completion_id=completion_id)
+
+        headers = {'x-ratelimit-remaining-requests': '1000', 'x-ratelimit-remaining-tokens': '1000000'}
+        if not body.get('stream'):
+            return web.json_response(completion, headers=headers)
+
+        include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+        response = web.StreamResponse(headers={**headers, 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        for chunk in self._stream_chunks(completion, include_usage):
+            await response.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+            if self.stream_chunk_delay > 0:
+                await asyncio.sleep(self.stream_chunk_delay)
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    def _stream_chunks(self, completion: dict, include_usage: bool):
+        choice = completion['choices'][0]
+        message = choice['message']
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> dict:
+            c = {
+                'id': completion['id'],
+                'object': 'chat.completion.chunk',
+                'created': completion['created'],
+                'model': completion['model'],
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}] if usage is None else []
+            }
+            if usage is not None:
+                c['usage'] = usage
+            return c
+
+        yield chunk({'role': 'assistant', 'content': ''})
+
+        content = message.get('content') or ''
+        words = content.split(' ')
+        for i, word in enumerate(words):
+            if word or i > 0:
+                yield chunk({'content': word if i == 0 else ' ' + word})
+
+        for index, call in enumerate(message.get('tool_calls') or []):
+            yield chunk({'tool_calls': [{'index': index, 'id': call['id'], 'type': 'function',
+                                         'function': {'name': call['function']['name'], 'arguments': ''}}]})
+            arguments = call['function']['arguments']
+            for start in range(0, len(arguments), 16):
+                yield chunk({'tool_calls': [{'index': index, 'function': {'arguments': arguments[start:start + 16]}}]})
+
+        yield chunk({}, finish_reason=choice['finish_reason'])
+        if include_usage:
+            yield chunk({}, usage=completion['usage'])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Local OpenAI-compatible chat-completions stub server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--script', help='JSON file with a list of scripted responses.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Base response latency in seconds.')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='Extra uniformly distributed latency in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with an error.')
+    parser.add_argument('--error-statuses', default='429,500,503', help='Comma-separated HTTP statuses to inject.')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with injected 429s.')
+    parser.add_argument('--stream-chunk-delay', type=float, default=0.0, help='Delay between streamed chunks in seconds.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    script = None
+    if args.script is not None:
+        with open(args.script, 'rt', encoding='utf-8') as f:
+            script = json.load(f)
+
+    server = StubServer(
+        MockScript(script),
+        latency=args.latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, error_statuses=[int(s) for s in args.error_statuses.split(',')],
+        retry_after=args.retry_after, stream_chunk_delay=args.stream_chunk_delay, seed=args.seed)
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(server.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
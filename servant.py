@@ -1,4 +1,6 @@
-from typing import Any, List, Dict
+from __future__ import annotations
+
+from typing import Any, List, Dict, TYPE_CHECKING
 import typing
 import dataclasses
 from dataclasses import dataclass, field
@@ -10,22 +12,32 @@ import json
 from textwrap import dedent
 import time
 import logging
+import signal
+import asyncio
 
 from clj import SExpr, sexpr
 from clj.exec import ExecutionContext, eval_sexpr, Quoted
 
 import openai
-from openai import AsyncOpenAI
-from gpt import ChatOpenAI, ChatAccounting, ChatSqliteCache
+from gpt import ChatOpenAI, ChatAccounting, ChatRace, ChatSqliteCache, ChatSemanticCache, set_accounting_labels
 
-import discord
-import discord.utils
+if TYPE_CHECKING:
+    # discord.py is only imported when the bot actually starts (see main())
+    import discord
+    from servant.memory import ConversationMemory
+    from servant.state import SharedStateStore
 
-from servant.weather import fetch_weather_forecast
-from servant.base.tools import ToolDispatcher, ToolDef
+from servant.base.tools import ToolDispatcher, ToolDef, ToolRouter, on_module_import
 from servant.base.json import obj_to_json, JSON, JSONDict, JSONArray
-
-import sqlite3
+from servant.base.rate_limiting import get_rate_limiter, prometheus_metrics as rate_limiter_metrics
+from servant.base.metrics import register_metrics, start_metrics_server
+from servant.base.tracing import span, configure_tracing
+from servant.base.profiling import SamplingProfiler, profile_for, toggle_profiler, default_profile_path, MAX_PROFILE_SECONDS
+from servant.base.user_cache import UserInfoCache
+from servant.base.triggers import TriggerMatcher
+from servant.base.messaging import ChannelSendQueue
+from servant.base.offload import configure_offload, get_offloader
+from servant.base.watchdog import LoopWatchdog
 
 _LOGGER = logging.getLogger(__name__ if __name__ != '__main__' else 'jeeves')
 
@@ -54,6 +66,36 @@ class Config:
     discord_token: str | None = None
     imgflip_username: str | None = None
     imgflip_password: str | None = None
+    geocode_cache_path: str | None = 'geocode.db'
+    gazetteer_path: str | None = None
+    osrm_url: str | None = None
+    metrics_port: int | None = None
+    trace_path: str | None = None
+    semantic_cache_path: str | None = None
+    memory_path: str | None = None
+    # Notes, schedule and channel personalities in sqlite, shared by all worker processes
+    state_path: str | None = None
+    # Sharding: the shards run by this process, out of `shard_count` in total
+    shard_count: int | None = None
+    shard_ids: List[int] | None = None
+    worker_index: int = 0
+    # Executors for work moved off the event loop (servant.base.offload)
+    offload_threads: int = 4
+    offload_processes: int = 0
+    # Log the stack of anything blocking the event loop longer than this many seconds
+    loop_watchdog_threshold: float = 0.5
+    # Models raced against the default one (ChatRace), in which channels (None: all), and the hedge
+    # policy: start the next model after this latency quantile, or all at once if None
+    race_models: List[str] = field(default_factory=list)
+    race_channels: List[str] | None = None
+    race_hedge_quantile: float | None = None
+    race_hedge_delay: float | None = None
+    # Discord user ids allowed to run admin commands (!PROFILE), in addition to the application owner
+    admin_ids: List[str] = field(default_factory=list)
+
+    def worker_path(self, path: str) -> str:
+        # Append-only stores (vector files) can't be shared between processes; give each worker its own
+        return f'{path}.worker{self.worker_index}' if self.shard_ids is not None else path
 
 
 @dataclass
@@ -159,13 +201,45 @@ class JeevesState:
     schedule: List[ScheduleItem]
     channel_messages: Dict[str, List[Dict[str, Any]]]
     channel_personality: Dict[str, str]
+    memory: ConversationMemory | None
+    send_queue: ChannelSendQueue
+    store: SharedStateStore | None
+
+    # Recent messages sent verbatim; older ones are only reachable through `memory`
+    HISTORY_WINDOW = 20
+    RECALL_COUNT = 5
+    RECALL_NOTE_COUNT = 5
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, memory: ConversationMemory | None = None, store: SharedStateStore | None = None):
         self.config = config
         self.notes = {}
         self.schedule = []
         self.channel_messages = defaultdict(list)
         self.channel_personality = {}
+        self.memory = memory
+        self.send_queue = ChannelSendQueue()
+        self.store = store
+        self.sync()
+
+    def sync(self) -> None:
+        # Reload shared state if another process changed it; our own writes go through immediately
+        if self.store is None or not self.store.changed():
+            return
+        notes, schedule, personalities = self.store.load()
+        self.notes = {note['title']: Note.from_json(note) for note in notes}
+        self.schedule = sorted((ScheduleItem.from_json(item) for item in schedule), key=lambda item: item.created_time)
+        self.channel_personality.update(personalities)
+
+    def set_channel_personality(self, channel_id: str, personality: str) -> None:
+        self.channel_personality[channel_id] = personality
+        if self.store is not None:
+            self.store.set_channel_personality(channel_id, personality)
+
+    def add_message(self, channel_id: str, message: Dict[str, Any], remember: bool = True) -> None:
+        # `remember=False` only keeps the message in the recent window, without indexing it in memory
+        self.channel_messages[channel_id].append(message)
+        if remember and self.memory is not None and message.get('role') in ('user', 'assistant') and isinstance(message.get('content'), str):
+            self.memory.add(channel_id, message['role'], message['content'])
 
     async def create_or_modify_note(self, title: str, content: str | None, important: bool | None = None) -> JSONDict:
         note = self.notes.get(title)
@@ -179,16 +253,22 @@ class JeevesState:
                     important=important if important is not None else False
                 )
                 self.notes[title] = note
+                if self.store is not None:
+                    self.store.put_note(title, note.to_json())
                 return { 'message': f'Note "{title}" was created.' }
         else:
             if content is None:
                 del self.notes[title]
+                if self.store is not None:
+                    self.store.delete_note(title)
                 return { 'message': f'Note "{title}" was deleted.' }
             else:
                 note.content = content
                 if important is not None:
                     note.important = important
                 note.updated_time = int(time.time())
+                if self.store is not None:
+                    self.store.put_note(title, note.to_json())
                 return { 'message': f'Note "{title}" was modified.' }
 
     async def show_note(self, title: str) -> JSONDict:
@@ -204,6 +284,8 @@ class JeevesState:
             for i, item in enumerate(self.schedule):
                 if item.title == title:
                     del self.schedule[i]
+                    if self.store is not None:
+                        self.store.delete_schedule_item(title)
                     return { 'message': f'Scheduled item "{title}" was deleted.' }
             return { 'error': f'Scheduled item "{title}" not found.', 'data': { 'title': title } }
         else:
@@ -216,6 +298,8 @@ class JeevesState:
                     if important is not None:
                         item.important = important
                     item.updated_time = int(time.time())
+                    if self.store is not None:
+                        self.store.put_schedule_item(title, item.to_json())
                     return { 'message': f'Scheduled item "{title}" was modified.' }
 
             item = ScheduleItem(
@@ -225,6 +309,8 @@ class JeevesState:
                 important=important if important is not None else False
             )
             self.schedule.append(item)
+            if self.store is not None:
+                self.store.put_schedule_item(title, item.to_json())
             return { 'message': f'Scheduled item "{title}".' }
 
     async def show_schedule(self) -> JSONArray:
@@ -258,7 +344,8 @@ class JeevesState:
                     }
                 }
             },
-            function=lambda obj: self.create_or_modify_note(obj['title'], obj.get('content'), obj.get('important'))
+            function=lambda obj: self.create_or_modify_note(obj['title'], obj.get('content'), obj.get('important')),
+            keywords=['note', 'remember', 'memo', 'forget', 'write down']
         )
 
         tools.register(
@@ -280,7 +367,8 @@ class JeevesState:
                     }
                 }
             },
-            function=lambda obj: self.show_note(obj['title'])
+            function=lambda obj: self.show_note(obj['title']),
+            keywords=['note', 'remember', 'memo', 'recall']
         )
 
         tools.register(
@@ -318,7 +406,8 @@ class JeevesState:
                 title=obj['title'],
                 description=obj.get('description'),
                 expression=obj.get('expression'),
-                important=obj.get('important'))
+                important=obj.get('important')),
+            keywords=['schedule', 'remind', 'calendar', 'event', 'appointment', 'meeting', 'tomorrow', 'next week', 'cancel']
         )
 
         tools.register(
@@ -330,149 +419,188 @@ class JeevesState:
                     'description': 'Show your schedule.'
                 }
             },
-            function=lambda obj: self.show_schedule()
+            function=lambda obj: self.show_schedule(),
+            keywords=['schedule', 'remind', 'calendar', 'event', 'appointment', 'agenda', 'plans']
+        )
+
+    async def build_messages(self, channel_id: str) -> List[Dict[str, Any]]:
+        personality_name = self.channel_personality.get(channel_id, 'Jeeves')
+        personality_name_short = personality_name[0]
+        channel_personality = self.config.personalities[personality_name].description
+
+        history = self.channel_messages[channel_id][-self.HISTORY_WINDOW:]
+        while history and history[0].get('role') == 'tool':
+            history.pop(0)
+
+        query = next((m['content'] for m in reversed(history) if m.get('role') == 'user' and isinstance(m.get('content'), str)), '')
+
+        notes = list(self.notes.values())
+        notes.sort(key=lambda note: (note.important, -note.updated_time), reverse=True)
+        relevant_notes = set()
+        if self.memory is not None:
+            # With memory, only important notes and the notes relevant to the message are listed (with content)
+            relevant_notes = set(self.memory.rank_notes(
+                {note.title: (note.content, note.updated_time) for note in notes if not note.important},
+                query, k=self.RECALL_NOTE_COUNT))
+        notes_text = []
+        for note in notes:
+            if self.memory is not None and not note.important and note.title not in relevant_notes:
+                continue
+            note_text = f' - **{note.title}**' + (' (important)' if note.important else '')
+            if note.important or note.title in relevant_notes:
+                note_text += ': ' + note.content
+            notes_text.append(note_text)
+        if len(notes_text) < len(notes):
+            notes_text.append(f' - ({len(notes) - len(notes_text)} other notes not shown; use `show_note` if you know the title)')
+        if notes_text:
+            notes_text_all = '\n' + '\n'.join(notes_text)
+        else:
+            notes_text_all = 'No notes recorded yet.'
+
+        schedule_items = list(self.schedule)
+        schedule_items.sort(key=lambda item: (item.important, item.updated_time), reverse=True)
+        schedule_text = []
+        for item in schedule_items:
+            schedule_text.append(f' - **{item.title}**' + (' (important)' if item.important else '') + f': {item.description} scheduled to occur "{item.expression}"')
+        if schedule_text:
+            schedule_text_all = '\n' + '\n'.join(schedule_text)
+        else:
+            schedule_text_all = 'No schedule items recorded yet.'
+
+        # Today's date
+        import datetime
+        import pytz
+        new_york_tz = pytz.timezone("America/New_York")
+        new_york_dt = datetime.datetime.now(new_york_tz)
+        new_york_date_str = new_york_dt.strftime('%A, %B %d, %Y')
+        new_york_time_str = new_york_dt.strftime('%H:%M:%S')
+
+        system_prompt = (dedent(
+            '''
+            # Tools
+
+            ## Current time and date
+            Current date and time in New York City is {{new_york_date_str}} and time is {{new_york_time_str}}.
+            When answering questions about the date and time, provide it in human readable form. Assume the users are in New York unless otherwise specified.
+            If you are asked about the time in a different location, provide the time in that location based on the timezone and UTC offset.
+
+            ## Notes
+            Write down any important information that can help you better serve the users. You can use the `create_or_modify_note` command to create or modify a note, and the `show_note` command to read a note. Set the `important` flag to `true` if the note is important for you to remember.
+            Notes: {{notes_text_all}}
+
+            ## Schedule
+            Use the `create_or_modify_my_schedule_item` command to write down any important events, tasks, reminders, or recurrent items that YOU need to remember.
+            Syntax for `expression` when using the `schedule_item` command:
+            - For a one-time event: "YYYY-MM-DD HH:MM:SS".
+            - For a recurrent event use Unix Cron syntax: "0 0 * * 0" (every Sunday at midnight).
+            - For a relative time: "in 2 hours", "in 3 days", "in 1 week", "in 1 month", "in 1 year", "in 1 hour 30 minutes".
+            - "next Monday at 9am", "next Tuesday at 3pm", "next Wednesday at 6pm", "next Thursday at 9pm", "next Friday at 12pm", "next Saturday at 3pm", "next Sunday at 6pm".
+            - "tomorrow at 9am", "tomorrow at 3pm", "tomorrow at 6pm", "tomorrow at 9pm", "tomorrow at 12pm", "tomorrow at 3pm", "tomorrow at 6pm".
+            Your Schedule: {{schedule_text_all}}
+
+            ## Weather
+            You can also use the `get_current_weather` command to get the current weather in a location. Ideally, the location should be specified in the format "City, Country".
+            When comparing the weather in several locations, use `get_current_weather_batch` to fetch them all in one call.
+
+            ## Distances
+            Use the `get_distance_matrix` command to get the great-circle and driving distances between several locations at once.
+
+            ## Image Generation
+            When generating images, review the "revised_prompt". If it is not what you expected or if the revised prompt makes too many unnecessary assumptions, try to rephrase and clarify the original prompt to get a better result. Explain to the user what revisions were made by the image generator, particularly if it is forced diversity or other politically correct changes. You can try:
+              * Replacing references to specific people with their appearance descriptions, e.g. "a senile old man" instead of "Joe Biden".
+              * Be more specific about intended demographic characteristics, e.g. "an elderly caucasian gentleman" instead of "an elderly gentleman". This is particularly important when the image generator makes unintended "diversity" changes.
+
+            # Your Personality
+            {{personality}}
+
+            # Communication Medium
+            The user messages will have the following format "Message from <user>: <content>".
+            Messages are passed to and from the users through Discord, so you can use Discord syntax (Markdown + Discord's extensions, e.g. ||<text>|| for hidden text - good for joke punchlines) for formatting.
+            Do not end your messages with a question unless it makes sense to do so in the context. You are chatting with people, not interrogating them.
+            ''')
+            .replace('{{notes_text_all}}', notes_text_all)
+            .replace('{{schedule_text_all}}', schedule_text_all)
+            .replace('{{new_york_date_str}}', new_york_date_str)
+            .replace('{{new_york_time_str}}', new_york_time_str)
+            .replace('{{personality}}', channel_personality)
+            .replace('{{personality_name}}', personality_name)
+            .replace('{{personality_name_short}}', personality_name_short)
         )
 
+        assert re.search(r'\{\{.*\}\}', system_prompt) is None, 'Unresolved template variable in system prompt.'
+
+        if self.memory is not None:
+            recalled = await self.memory.recall(
+                channel_id, query, k=self.RECALL_COUNT,
+                exclude=[m['content'] for m in history if isinstance(m.get('content'), str)])
+            if recalled:
+                recalled_text = []
+                for item in recalled:
+                    when = time.strftime('%Y-%m-%d %H:%M', time.localtime(item.created_time))
+                    content = item.content if item.role == 'user' else f'Message from {personality_name}: {item.content}'
+                    recalled_text.append(f' - [{when}] {content}')
+                system_prompt += '\n# Recalled Conversation\nEarlier messages from this channel that may be relevant:\n' + '\n'.join(recalled_text) + '\n'
+
+        jeeves_messages = []
+        jeeves_messages.append({ 'role': 'system', 'content': system_prompt })
+
+        for message in history:
+            jeeves_messages.append(message)
+        # jeeves_messages.append({ 'role': 'user', 'content': discord_message.content })
+
+        return jeeves_messages
+
     async def reply(self, discord_message, content):
-        while True:
-            content = content.strip()
-            if len(content) == 0:
-                break
-            if len(content) <= 2000:
-                await discord_message.channel.send(content)
-                break
-            else:
-                line_break = content.rfind('\n', 0, 2000)
-                if line_break == -1:
-                    space_break = content.rfind(' ', 0, 2000)
-                    if space_break == -1:
-                        await discord_message.channel.send(content[:2000])
-                        content = content[2000:]
-                    else:
-                        await discord_message.channel.send(content[:space_break])
-                        content = content[space_break + 1:]
-                else:
-                    await discord_message.channel.send(content[:line_break])
-                    content = content[line_break + 1:]
+        with span('reply', length=len(content)):
+            await self.send_queue.send(discord_message.channel, content)
 
     async def handle_incoming_message(self, client: discord.Client, discord_message: discord.Message, openai_client: ChatOpenAI, tools: ToolDispatcher, debug_mode: bool = False):
         channel_id = str(discord_message.channel.id)
 
         personality_name = self.channel_personality.get(channel_id, 'Jeeves')
         personality_name_short = personality_name[0]
-        channel_personality = self.config.personalities[personality_name].description
+
+        set_accounting_labels(channel=channel_id, personality=personality_name)
 
         # React to the message with a thumbs up emoji
-        try:
-            await discord_message.add_reaction('🤔')
-        except Exception as e:
-            _LOGGER.error(f'Failed to add reaction to message: {e}')
-            pass
+        with span('add_reaction'):
+            try:
+                await discord_message.add_reaction('🤔')
+            except Exception as e:
+                _LOGGER.error(f'Failed to add reaction to message: {e}')
+                pass
 
         # Add a typing indicator
         try:
             async with discord_message.channel.typing():
-                notes = list(self.notes.values())
-                notes.sort(key=lambda note: (note.important, -note.updated_time), reverse=True)
-                notes_text = []
-                for note in notes:
-                    note_text = f' - **{note.title}**' + (' (important)' if note.important else '')
-                    if note.important:
-                        note_text += ': ' + note.content
-                    notes_text.append(note_text)
-                if notes_text:
-                    notes_text_all = '\n' + '\n'.join(notes_text)
-                else:
-                    notes_text_all = 'No notes recorded yet.'
-
-                schedule_items = list(self.schedule)
-                schedule_items.sort(key=lambda item: (item.important, item.updated_time), reverse=True)
-                schedule_text = []
-                for item in schedule_items:
-                    schedule_text.append(f' - **{item.title}**' + (' (important)' if item.important else '') + f': {item.description} scheduled to occur "{item.expression}"')
-                if schedule_text:
-                    schedule_text_all = '\n' + '\n'.join(schedule_text)
-                else:
-                    schedule_text_all = 'No schedule items recorded yet.'
-
-                # Today's date
-                import datetime
-                import pytz
-                new_york_tz = pytz.timezone("America/New_York")
-                new_york_dt = datetime.datetime.now(new_york_tz)
-                new_york_date_str = new_york_dt.strftime('%A, %B %d, %Y')
-                new_york_time_str = new_york_dt.strftime('%H:%M:%S')
-
-                system_prompt = (dedent(
-                    '''
-                    # Tools
-
-                    ## Current time and date
-                    Current date and time in New York City is {{new_york_date_str}} and time is {{new_york_time_str}}.
-                    When answering questions about the date and time, provide it in human readable form. Assume the users are in New York unless otherwise specified.
-                    If you are asked about the time in a different location, provide the time in that location based on the timezone and UTC offset.
-
-                    ## Notes
-                    Write down any important information that can help you better serve the users. You can use the `create_or_modify_note` command to create or modify a note, and the `show_note` command to read a note. Set the `important` flag to `true` if the note is important for you to remember.
-                    Notes: {{notes_text_all}}
-
-                    ## Schedule
-                    Use the `create_or_modify_my_schedule_item` command to write down any important events, tasks, reminders, or recurrent items that YOU need to remember.
-                    Syntax for `expression` when using the `schedule_item` command:
-                    - For a one-time event: "YYYY-MM-DD HH:MM:SS".
-                    - For a recurrent event use Unix Cron syntax: "0 0 * * 0" (every Sunday at midnight).
-                    - For a relative time: "in 2 hours", "in 3 days", "in 1 week", "in 1 month", "in 1 year", "in 1 hour 30 minutes".
-                    - "next Monday at 9am", "next Tuesday at 3pm", "next Wednesday at 6pm", "next Thursday at 9pm", "next Friday at 12pm", "next Saturday at 3pm", "next Sunday at 6pm".
-                    - "tomorrow at 9am", "tomorrow at 3pm", "tomorrow at 6pm", "tomorrow at 9pm", "tomorrow at 12pm", "tomorrow at 3pm", "tomorrow at 6pm".
-                    Your Schedule: {{schedule_text_all}}
-
-                    ## Weather
-                    You can also use the `get_current_weather` command to get the current weather in a location. Ideally, the location should be specified in the format "City, Country".
-
-                    ## Image Generation
-                    When generating images, review the "revised_prompt". If it is not what you expected or if the revised prompt makes too many unnecessary assumptions, try to rephrase and clarify the original prompt to get a better result. Explain to the user what revisions were made by the image generator, particularly if it is forced diversity or other politically correct changes. You can try:
-                      * Replacing references to specific people with their appearance descriptions, e.g. "a senile old man" instead of "Joe Biden".
-                      * Be more specific about intended demographic characteristics, e.g. "an elderly caucasian gentleman" instead of "an elderly gentleman". This is particularly important when the image generator makes unintended "diversity" changes.
-
-                    # Your Personality
-                    {{personality}}
-
-                    # Communication Medium
-                    The user messages will have the following format "Message from <user>: <content>".
-                    Messages are passed to and from the users through Discord, so you can use Discord syntax (Markdown + Discord's extensions, e.g. ||<text>|| for hidden text - good for joke punchlines) for formatting.
-                    Do not end your messages with a question unless it makes sense to do so in the context. You are chatting with people, not interrogating them.
-                    ''')
-                    .replace('{{notes_text_all}}', notes_text_all)
-                    .replace('{{schedule_text_all}}', schedule_text_all)
-                    .replace('{{new_york_date_str}}', new_york_date_str)
-                    .replace('{{new_york_time_str}}', new_york_time_str)
-                    .replace('{{personality}}', channel_personality)
-                    .replace('{{personality_name}}', personality_name)
-                    .replace('{{personality_name_short}}', personality_name_short)
-                )
-
-                assert re.search(r'\{\{.*\}\}', system_prompt) is None, 'Unresolved template variable in system prompt.'
-
-                jeeves_messages = []
-                jeeves_messages.append({ 'role': 'system', 'content': system_prompt })
-
-                last_20_messages = self.channel_messages[channel_id][-20:]
-                while last_20_messages and last_20_messages[0].get('role') == 'tool':
-                    last_20_messages.pop(0)
-
-                for message in last_20_messages:
-                    jeeves_messages.append(message)
-                # jeeves_messages.append({ 'role': 'user', 'content': discord_message.content })
+                with span('build_prompt'):
+                    jeeves_messages = await self.build_messages(channel_id)
 
+                # Route tools on the latest few user messages
+                recent_text = '\n'.join(m['content'] for m in jeeves_messages[-6:] if m.get('role') == 'user' and isinstance(m.get('content'), str))
+                tools_expanded = False
+                tools_called = set()
 
+                iteration = 0
                 while True:
-                    try:
-                        response = await openai_client.async_request(
-                            messages=jeeves_messages,
-                            tools=tools.schema)
-                    except openai.APIError as e:
-                        _LOGGER.error(f"OpenAI API Error: {e}")
-                        return
+                    tool_selection = tools.select_schema(channel_id, recent_text, expanded=tools_expanded, include=tools_called)
+                    if tool_selection.saved_tokens > 0:
+                        _LOGGER.info(f"Sending {len(tool_selection.names)} tools ({', '.join(tool_selection.names)}), "
+                                     f"saving ~{tool_selection.saved_tokens} prompt tokens")
+
+                    with span('llm_request', iteration=iteration, message_count=len(jeeves_messages),
+                              tool_count=len(tool_selection.names), tool_tokens_saved=tool_selection.saved_tokens) as s:
+                        try:
+                            response = await openai_client.async_request(
+                                messages=jeeves_messages,
+                                tools=tool_selection.schema)
+                        except openai.APIError as e:
+                            _LOGGER.error(f"OpenAI API Error: {e}")
+                            return
+                        if s is not None and 'usage' in response:
+                            s.set_attribute('prompt_tokens', response.usage.prompt_tokens)
+                            s.set_attribute('completion_tokens', response.usage.completion_tokens)
+                    iteration += 1
 
                     result = response.choices[0]
                     jeeves_messages.append(result['message'])
@@ -490,7 +618,7 @@ class JeevesState:
                             content = content[len('Message from J:'):].strip()
                         result['message']['content'] = content
                         await self.reply(discord_message, content)
-                        self.channel_messages[channel_id].append(result['message'])
+                        self.add_message(channel_id, result['message'])
                         break
 
                     elif finish_reason == 'tool_calls':
@@ -503,41 +631,57 @@ class JeevesState:
                         tool_messages.append(result['message'])  # extend conversation with tool calls
 
                         for tool_call in tool_calls:
-                            tool_id = tool_call['id']
-                            tool_function = tool_call['function']
+                            with span('tool_call', tool=tool_call['function']['name']):
+                                tool_id = tool_call['id']
+                                tool_function = tool_call['function']
 
-                            tool_name = tool_function['name']
-                            tool_arguments = json.loads(tool_function['arguments'])
+                                tool_name = tool_function['name']
+                                tool_arguments = await get_offloader().loads(tool_function['arguments'])
 
-                            _LOGGER.info(f"Calling tool {tool_name} with arguments {tool_arguments}")
+                                tools_called.add(tool_name)
+                                if tool_name == ToolRouter.EXPAND_TOOL_NAME:
+                                    tools_expanded = True
 
-                            tool_arguments['discord_client'] = client
-                            tool_arguments['discord_message'] = discord_message
+                                _LOGGER.info(f"Calling tool {tool_name} with arguments {tool_arguments}")
 
-                            result = await tools.dispatch(tool_name, tool_arguments)
+                                tool_arguments['discord_client'] = client
+                                tool_arguments['discord_message'] = discord_message
 
-                            _LOGGER.info(f"Tool {tool_name} returned {result}")
+                                result = await tools.dispatch(tool_name, tool_arguments)
 
-                            msg = {
-                                "tool_call_id": tool_id,
-                                "role": "tool",
-                                "name": tool_name,
-                                "content": json.dumps(obj_to_json(result), ensure_ascii=False)
-                            }
+                                _LOGGER.info(f"Tool {tool_name} returned {result}")
+
+                                msg = {
+                                    "tool_call_id": tool_id,
+                                    "role": "tool",
+                                    "name": tool_name,
+                                    "content": await get_offloader().dumps(result)
+                                }
 
-                            jeeves_messages.append(msg)  # extend conversation with function response
-                            tool_messages.append(msg)
+                                jeeves_messages.append(msg)  # extend conversation with function response
+                                tool_messages.append(msg)
 
                         self.channel_messages[channel_id].extend(tool_messages)
         finally:
-            try:
-                await discord_message.remove_reaction('🤔', client.user)
-            except Exception as e:
-                _LOGGER.error(f'Failed to remove reaction from message: {e}')
-                pass
+            with span('remove_reaction'):
+                try:
+                    await discord_message.remove_reaction('🤔', client.user)
+                except Exception as e:
+                    _LOGGER.error(f'Failed to remove reaction from message: {e}')
+                    pass
 
 
-async def main():
+def closest_names(name: str, names: List[str], count: int) -> List[str]:
+    # Module level so it can run in the offload process pool
+    import Levenshtein
+    name = name.lower()
+    return sorted(names, key=lambda candidate: Levenshtein.distance(name, candidate.lower()))[:count]
+
+
+async def main(shard_ids: List[int] | None = None, shard_count: int | None = None, worker_index: int = 0):
+    import discord
+    import discord.utils
+
     from clj.types import SExpr
     from clj.parser import sexpr
     from clj.exec import ExecutionContext, eval_sexpr
@@ -574,30 +718,171 @@ async def main():
         config.imgflip_password = password.value
     ctx.register(set_imgflip_credentials, name='imgflip-credentials')
 
+    def set_geocode_cache(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.geocode_cache_path = path.value
+    ctx.register(set_geocode_cache, name='geocode-cache')
+
+    def set_gazetteer(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.gazetteer_path = path.value
+    ctx.register(set_gazetteer, name='gazetteer')
+
+    def set_osrm_url(ctx: ExecutionContext, url: SExpr.Str) -> None:
+        assert isinstance(url, SExpr.Str)
+        config.osrm_url = url.value
+    ctx.register(set_osrm_url, name='osrm-url')
+
+    def set_metrics_port(ctx: ExecutionContext, port: SExpr.Atom | SExpr.Str) -> None:
+        assert isinstance(port, (SExpr.Atom, SExpr.Str))
+        config.metrics_port = int(port.value)
+    ctx.register(set_metrics_port, name='metrics-port')
+
+    def set_trace_path(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.trace_path = path.value
+    ctx.register(set_trace_path, name='trace-file')
+
+    def set_semantic_cache_path(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.semantic_cache_path = path.value
+    ctx.register(set_semantic_cache_path, name='semantic-cache')
+
+    def set_memory_path(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.memory_path = path.value
+    ctx.register(set_memory_path, name='memory')
+
+    def set_state_path(ctx: ExecutionContext, path: SExpr.Str) -> None:
+        assert isinstance(path, SExpr.Str)
+        config.state_path = path.value
+    ctx.register(set_state_path, name='shared-state')
+
+    def set_shard_count(ctx: ExecutionContext, count: SExpr.Atom | SExpr.Str) -> None:
+        assert isinstance(count, (SExpr.Atom, SExpr.Str))
+        config.shard_count = int(count.value)
+    ctx.register(set_shard_count, name='shards')
+
+    def set_offload_workers(ctx: ExecutionContext, threads: SExpr.Atom | SExpr.Str, processes: SExpr.Atom | SExpr.Str) -> None:
+        assert isinstance(threads, (SExpr.Atom, SExpr.Str)) and isinstance(processes, (SExpr.Atom, SExpr.Str))
+        config.offload_threads = int(threads.value)
+        config.offload_processes = int(processes.value)
+    ctx.register(set_offload_workers, name='offload-workers')
+
+    def set_loop_watchdog(ctx: ExecutionContext, threshold: SExpr.Atom | SExpr.Str) -> None:
+        assert isinstance(threshold, (SExpr.Atom, SExpr.Str))
+        config.loop_watchdog_threshold = float(threshold.value)
+    ctx.register(set_loop_watchdog, name='loop-watchdog')
+
+    def set_race_models(ctx: ExecutionContext, *models: SExpr.Str) -> None:
+        assert all(isinstance(model, SExpr.Str) for model in models)
+        config.race_models = [model.value for model in models]
+    ctx.register(set_race_models, name='race-models')
+
+    def set_race_channels(ctx: ExecutionContext, *channels: SExpr.Atom | SExpr.Str) -> None:
+        assert all(isinstance(channel, (SExpr.Atom, SExpr.Str)) for channel in channels)
+        config.race_channels = [str(channel.value) for channel in channels]
+    ctx.register(set_race_channels, name='race-channels')
+
+    def set_race_hedge(ctx: ExecutionContext, quantile: SExpr.Atom | SExpr.Str, delay: SExpr.Atom | SExpr.Str) -> None:
+        assert isinstance(quantile, (SExpr.Atom, SExpr.Str)) and isinstance(delay, (SExpr.Atom, SExpr.Str))
+        config.race_hedge_quantile = float(quantile.value)
+        config.race_hedge_delay = float(delay.value)
+    ctx.register(set_race_hedge, name='race-hedge')
+
+    def set_admins(ctx: ExecutionContext, *user_ids: SExpr.Atom | SExpr.Str) -> None:
+        assert all(isinstance(user_id, (SExpr.Atom, SExpr.Str)) for user_id in user_ids)
+        config.admin_ids = [str(user_id.value) for user_id in user_ids]
+    ctx.register(set_admins, name='admins')
+
     eval_sexpr(ctx, sexpr(open('jeeves.clj').read()))
     eval_sexpr(ctx, sexpr(open('.private.clj').read()))
     #print(config)
     # return
 
-    raw_client = openai.AsyncOpenAI(api_key=config.openai_key)
+    # Command line (set by run_workers) overrides the config file
+    if shard_count is not None:
+        config.shard_count = shard_count
+    config.shard_ids = shard_ids
+    config.worker_index = worker_index
+    if config.shard_ids is not None and config.state_path is None:
+        _LOGGER.warning('Running a subset of shards without (shared-state ...): notes, schedule and personalities are per process')
+
+    configure_tracing(config.trace_path)
+
+    # Retries are left to ChatOpenAI, whose rate controller needs to see every 429/5xx
+    raw_client = openai.AsyncOpenAI(api_key=config.openai_key, max_retries=0)
+
+    def model_backend(model: str, limiter_name: str) -> ChatOpenAI:
+        # Each model gets its own concurrency controller, retry budget and rate limiter
+        return ChatOpenAI(
+            raw_client,
+            defaults={
+                'model': model,
+                'timeout': 300,
+                'max_tokens': 1024
+            },
+            rate_limiter=get_rate_limiter(limiter_name, rate=5.0, burst=10))
+
+    openai_client = model_backend("gpt-4o", 'openai')
 
-    openai_client = ChatOpenAI(
-        raw_client,
-        defaults={
-            'model': "gpt-4o",
-            'timeout': 300,
-            'max_tokens': 1024
-        })
+    race = None
+    if config.race_models:
+        # Below the caches, so a cached answer is never raced
+        race = ChatRace(
+            [openai_client] + [model_backend(model, f'openai.{model}') for model in config.race_models],
+            names=[openai_client.defaults['model']] + config.race_models,
+            hedge_delay=config.race_hedge_delay,
+            hedge_quantile=config.race_hedge_quantile,
+            channels=config.race_channels)
+        openai_client = race
 
     openai_client = ChatSqliteCache(openai_client, 'cache.db')
-    openai_client = ChatAccounting(openai_client)
+    if config.semantic_cache_path is not None:
+        openai_client = ChatSemanticCache(openai_client, config.worker_path(config.semantic_cache_path))
+    accounting = ChatAccounting(openai_client)
+    openai_client = accounting
+
+    register_metrics(accounting.prometheus_metrics)
+    register_metrics(rate_limiter_metrics)
+    if race is not None:
+        register_metrics(race.prometheus_metrics)
+    register_metrics(configure_offload(threads=config.offload_threads, processes=config.offload_processes).prometheus_metrics)
+
+    watchdog = LoopWatchdog(threshold=config.loop_watchdog_threshold)
+    watchdog.start()
+    register_metrics(watchdog.prometheus_metrics)
+    if config.metrics_port is not None:
+        await start_metrics_server(port=config.metrics_port + config.worker_index)
+
+    # Applied when a geo tool is first dispatched, so startup doesn't import servant.geo
+    def configure_geo(geo) -> None:
+        geo.configure_geocoder(cache_path=config.geocode_cache_path, gazetteer_path=config.gazetteer_path)
+        if config.osrm_url is not None:
+            geo.configure_osrm(config.osrm_url)
+    on_module_import('servant.geo', configure_geo)
 
     tools = ToolDispatcher({})
 
-    import servant.weather
-    servant.weather.register_tools(tools)
+    import servant.tools
+    servant.tools.register_builtin_tools(tools)
+
+    # Only send the tools relevant to the conversation; notes are always offered since the
+    # prompt asks the model to write them down proactively.
+    tools.enable_routing(ToolRouter(top_k=4, always=['create_or_modify_note']))
+
+    memory = None
+    if config.memory_path is not None:
+        from servant.memory import ConversationMemory
+        memory = ConversationMemory(config.worker_path(config.memory_path))
+        _LOGGER.info(f'Loaded conversation memory with {len(memory)} messages')
+
+    store = None
+    if config.state_path is not None:
+        from servant.state import SharedStateStore
+        store = SharedStateStore(config.state_path)
 
-    jeeves_state = JeevesState(config=config)
+    jeeves_state = JeevesState(config=config, memory=memory, store=store)
     jeeves_state.register_tools(tools)
 
     # import numpy as np
@@ -652,7 +937,7 @@ async def main():
         channel_id = str(discord_message.channel.id)
         if personality not in config.personalities:
             return { 'error': f'Personality "{personality}" not found.' }
-        jeeves_state.channel_personality[channel_id] = personality
+        jeeves_state.set_channel_personality(channel_id, personality)
         return { 'message': f'Personality switched to "{personality}".' }
 
     tools.register(
@@ -675,7 +960,9 @@ async def main():
                 }
             }
         },
-        function=lambda obj: switch_personality(obj['discord_message'], obj['personality'])
+        function=lambda obj: switch_personality(obj['discord_message'], obj['personality']),
+        # Not the personality names: every addressed message contains one (the trigger)
+        keywords=['personality', 'switch', 'become', 'pretend', 'act as', 'persona']
     )
 
     async def generate_image(prompt: str) -> JSONDict:
@@ -709,7 +996,8 @@ async def main():
                 }
             }
         },
-        function=lambda obj: generate_image(obj['prompt'])
+        function=lambda obj: generate_image(obj['prompt']),
+        keywords=['image', 'picture', 'draw', 'paint', 'photo', 'illustrat', 'sketch', 'render', 'dall']
     )
 
     import requests
@@ -735,12 +1023,9 @@ async def main():
 
         if meme_id is None:
             # Find the closest few matches
-            matches = []
-            import Levenshtein
-            for meme in all_memes['data']['memes']:
-                matches.append((meme['name'], Levenshtein.distance(name.lower(), meme['name'].lower())))
-            matches.sort(key=lambda x: x[1])
-            return { 'error': f'Meme template "{name}" not found. Closest matches: {[x[0] for x in matches[:10]]}' }
+            names = [meme['name'] for meme in all_memes['data']['memes']]
+            matches = await get_offloader().run(closest_names, name, names, 10, cpu_bound=True)
+            return { 'error': f'Meme template "{name}" not found. Closest matches: {matches}' }
 
         data = {
             'template_id': meme_id,
@@ -762,6 +1047,7 @@ async def main():
 
         print(data)
 
+        await get_rate_limiter('imgflip', rate=1.0, burst=3)()
         r = requests.post('https://api.imgflip.com/caption_image', data=data, headers=headers)
 
         rj = r.json()
@@ -794,7 +1080,8 @@ async def main():
                 }
             }
         },
-        function=lambda obj: generate_meme(obj['template_name'], obj['box_text'])
+        function=lambda obj: generate_meme(obj['template_name'], obj['box_text']),
+        keywords=['meme', 'template', 'caption']
     )
 
 
@@ -817,65 +1104,142 @@ async def main():
     # )
 
 
-    class MyClient(discord.Client):
+    triggers = TriggerMatcher(config.personalities)
+
+    # With sharding, each process connects only its own shards; Discord routes every guild to one
+    # shard, so per-channel state (history, memory, send queues) stays within one process.
+    ClientBase = discord.AutoShardedClient if config.shard_count is not None else discord.Client
+
+    class MyClient(ClientBase):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.user_cache = UserInfoCache(self.fetch_user)
+            self.admin_ids = set(config.admin_ids)
+
         async def on_ready(self):
             _LOGGER.info(f'Logged on as {self.user}!')
+            app = await self.application_info()
+            if app.team is not None:
+                self.admin_ids.update(str(member.id) for member in app.team.members)
+            else:
+                self.admin_ids.add(str(app.owner.id))
+            # Seed from the gateway member cache (intents.members) so mentions rarely need a REST call
+            for guild in self.guilds:
+                self.user_cache.put_users(guild.members)
+
+        async def on_member_join(self, member):
+            self.user_cache.put_users([member])
+
+        async def on_member_update(self, before, after):
+            self.user_cache.put_users([after])
+
+        async def on_user_update(self, before, after):
+            self.user_cache.put_users([after])
 
         async def get_user_info(self, user_id):
-            user = await self.fetch_user(user_id)
-            return {
-                'id': user.id,
-                'name': user.name,
-                'discriminator': user.discriminator
-            }
+            users = await self.user_cache.resolve([user_id])
+            if user_id not in users:
+                raise ValueError(f'Unknown user {user_id}')
+            return users[user_id].to_json()
+
+        async def decode_mentions(self, discord_message, content: str, fetch_missing: bool) -> str:
+            # <@USER_ID> / <@!USER_ID> -> <@USER_ID:name>; users the cache can't resolve are left as is
+            mentions = [int(user_id) for user_id in re.findall(r'<@!?(\d+)>', content)]
+            if not mentions:
+                return content
+            with span('decode_mentions', count=len(mentions)):
+                # Mentioned users come with the message payload
+                self.user_cache.put_users(discord_message.mentions)
+                users = await self.user_cache.resolve(mentions, fetch_missing=fetch_missing)
+
+            def replace(match: re.Match) -> str:
+                info = users.get(int(match.group(1)))
+                return f'<@{info.id}:{info.name}>' if info is not None else match.group(0)
+            return re.sub(r'<@!?(\d+)>', replace, content)
 
         async def on_message(self, discord_message):
-            _LOGGER.info(f'Message from {discord_message.author}: {discord_message.content}')
+            with span('on_message', channel=str(discord_message.channel.id)):
+                _LOGGER.info(f'Message from {discord_message.author}: {discord_message.content}')
 
-            if discord_message.author == self.user:
-                return
+                if discord_message.author == self.user:
+                    return
 
-            dm_content = discord_message.content
+                jeeves_state.sync()
 
-            # Decode <@USER_ID> mentions
-            for user_id in re.findall(r'<@!?(\d+)>', dm_content):
-                user_info = await self.fetch_user(int(user_id))
-                dm_content = dm_content.replace(f'<@{user_id}>', f'<@{user_id}:{user_info.name}>')
+                channel_id = str(discord_message.channel.id)
+                if channel_id not in jeeves_state.channel_personality:
+                    jeeves_state.channel_personality[channel_id] = 'Jeeves'
 
-            _LOGGER.info(f'Message from {discord_message.author}: {dm_content}')
+                # Cheap check first: is the message addressed to us ("Jeeves", "J" or an @mention)?
+                content = discord_message.content
+                addressed = (
+                    triggers.matches(jeeves_state.channel_personality[channel_id], content)
+                    or self.user in discord_message.mentions)
 
-            channel_id = str(discord_message.channel.id)
-            jeeves_state.channel_messages[channel_id].append({
-                'role': 'user',
-                'content': f'Message from {discord_message.author}: {dm_content}' })
+                if not addressed and not content.startswith('!'):
+                    # Keep it as context for later replies, but skip mention decoding and memory indexing
+                    jeeves_state.add_message(channel_id, {
+                        'role': 'user',
+                        'content': f'Message from {discord_message.author}: {content}' }, remember=False)
+                    return
 
-            # Check if message contains "\bJeeves\b" or "\bJ\b"
+                dm_content = await self.decode_mentions(discord_message, content, fetch_missing=addressed)
 
-            msg = dm_content
+                _LOGGER.info(f'Message from {discord_message.author}: {dm_content}')
 
-            if msg.startswith('!EXIT'):
-                await self.close()
-                sys.exit(0)
-                return
+                jeeves_state.add_message(channel_id, {
+                    'role': 'user',
+                    'content': f'Message from {discord_message.author}: {dm_content}' })
 
-            if msg.startswith('!DEBUG '):
-                msg = msg[len('!DEBUG '):]
-                debug_mode = True
-            else:
-                debug_mode = False
+                msg = dm_content
 
-            channel_id = str(discord_message.channel.id)
-            if channel_id not in jeeves_state.channel_personality:
-                jeeves_state.channel_personality[channel_id] = 'Jeeves'
+                if msg.startswith('!EXIT'):
+                    await self.close()
+                    sys.exit(0)
+                    return
 
-            personality_name = jeeves_state.channel_personality[channel_id]
-            personality_name_short = personality_name[0]
+                if msg.startswith('!DEBUG '):
+                    msg = msg[len('!DEBUG '):]
+                    debug_mode = True
+                else:
+                    debug_mode = False
 
-            if not re.search(fr'\b{personality_name}\b', msg, re.IGNORECASE) and not re.search(fr'\b{personality_name_short}\b', msg, re.IGNORECASE):
-                return
+                if not addressed:
+                    return
 
-            await jeeves_state.handle_incoming_message(
-                client=client, discord_message=discord_message, openai_client=openai_client, tools=tools, debug_mode=debug_mode)
+                if msg.startswith('!PROFILE'):
+                    # !PROFILE [seconds] Jeeves - sample all threads under live traffic and write a collapsed-stack file
+                    if str(discord_message.author.id) not in self.admin_ids:
+                        await discord_message.channel.send('I am afraid only the administrators may do that, sir.')
+                        return
+                    args = msg[len('!PROFILE'):].split()
+                    arg = args[0] if args and not triggers.matches(jeeves_state.channel_personality[channel_id], args[0]) else ''
+                    try:
+                        seconds = float(arg) if arg else 30.0
+                    except ValueError:
+                        seconds = float('nan')
+                    if not seconds > 0:
+                        await discord_message.channel.send(f'Usage: !PROFILE [seconds] (at most {MAX_PROFILE_SECONDS:g})')
+                        return
+                    seconds = min(seconds, MAX_PROFILE_SECONDS)
+                    await discord_message.channel.send(f'Profiling for {seconds:g}s...')
+                    path = await profile_for(seconds)
+                    await discord_message.channel.send(f'Profile written to `{path}`.')
+                    return
+
+                if debug_mode:
+                    # Profile just this message
+                    profiler = SamplingProfiler()
+                    profiler.start()
+                try:
+                    await jeeves_state.handle_incoming_message(
+                        client=client, discord_message=discord_message, openai_client=openai_client, tools=tools, debug_mode=debug_mode)
+                finally:
+                    if debug_mode:
+                        profiler.stop()
+                        path = default_profile_path()
+                        profiler.write_collapsed(path)
+                        _LOGGER.info(f'Debug profile for message {discord_message.id} written to {path}')
 
 
     intents = discord.Intents.default()
@@ -887,15 +1251,43 @@ async def main():
     intents.reactions = True
     intents.guild_messages = True
 
-    client = MyClient(intents=intents)
+    if config.shard_count is not None:
+        client = MyClient(intents=intents, shard_count=config.shard_count, shard_ids=config.shard_ids)
+        _LOGGER.info(f'Worker {config.worker_index} running shards {config.shard_ids or "all"} of {config.shard_count}')
+    else:
+        client = MyClient(intents=intents)
+
+    if hasattr(signal, 'SIGUSR1'):
+        # `kill -USR1 <pid>` starts the sampling profiler, a second one stops it and writes the profile
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiler)
 
     discord.utils.setup_logging()
 
     await client.start(config.discord_token, reconnect=True)
 
 
+def run_workers(workers: int, shard_count: int) -> int:
+    # Runs `workers` bot processes with the shards spread round-robin over them. Shared state must be
+    # configured with (shared-state "...") so notes, schedule and personalities are seen by all.
+    import subprocess
+
+    processes = []
+    for worker_index in range(workers):
+        shard_ids = ','.join(str(shard_id) for shard_id in range(worker_index, shard_count, workers))
+        processes.append(subprocess.Popen([
+            sys.executable, __file__,
+            '--shard-count', str(shard_count), '--shard-ids', shard_ids, '--worker-index', str(worker_index)]))
+
+    try:
+        return max(process.wait() for process in processes)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        return max(process.wait() for process in processes)
+
+
 if __name__ == "__main__":
-    import sys, asyncio, os
+    import sys, asyncio, os, argparse
 
     if sys.platform.lower() == "win32":
         os.system('color')
@@ -905,6 +1297,26 @@ if __name__ == "__main__":
 
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--preflight', action='store_true', help='Install missing optional dependencies of the tool modules, then exit.')
+    parser.add_argument('--workers', type=int, help='Run this many sharded worker processes.')
+    parser.add_argument('--shard-count', type=int, help='Total number of shards (defaults to --workers).')
+    parser.add_argument('--shard-ids', help='Comma-separated shards run by this process.')
+    parser.add_argument('--worker-index', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.preflight:
+        from servant.base.install import preflight
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(0 if preflight() else 1)
+
+    if args.workers is not None:
+        logging.basicConfig(level=logging.INFO)
+        sys.exit(run_workers(args.workers, args.shard_count or args.workers))
+
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
-    loop.run_until_complete(main())
+    loop.run_until_complete(main(
+        shard_ids=[int(shard_id) for shard_id in args.shard_ids.split(',')] if args.shard_ids else None,
+        shard_count=args.shard_count,
+        worker_index=args.worker_index))
@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+STOPWORDS = frozenset('''
+    a an the and or but if of in on at to for from by with about as into over under than then
+    is are was were be been being am do does did doing have has had having will would shall should
+    can could may might must i me my we our you your he him his she her it its they them their
+    this that these those what whats which who whom whose when where why how there here
+    s t d ll re ve m not no yes please tell me show give now today right just like
+'''.split())
+
+
+def content_words(text: str) -> frozenset:
+    # Non-stopword tokens; used to keep lexically similar questions about different
+    # entities ("weather in Paris" / "weather in London") apart.
+    return frozenset(w for w in _WORD_RE.findall(text.casefold()) if w not in STOPWORDS)
+
+
+class HashedNgramEmbedder:
+    # Dependency-free local text embedding: word unigrams/bigrams and character trigrams are
+    # hashed (crc32, so stable across processes) into `dim` signed buckets and L2-normalized.
+    # Cosine similarity of these vectors tracks lexical overlap, which is enough to match
+    # rephrasings like "weather in paris?" / "what's the weather like in Paris".
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[Tuple[str, float]]:
+        words = _WORD_RE.findall(text.casefold())
+        features = [(f'w:{w}', 0.2 if w in STOPWORDS else 1.0) for w in words]
+        features += [(f'b:{a} {b}', 1.0) for a, b in zip(words, words[1:])]
+        for w in words:
+            padded = f'^{w}$'
+            features += [(f'c:{padded[i:i + 3]}', 0.5) for i in range(len(padded) - 2)]
+        return features
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += weight if (h >> 31) & 1 else -weight
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class VectorIndex:
+    # Append-only on-disk vector store (raw float32 rows, read through np.memmap) with a
+    # random-hyperplane LSH index for approximate search. Small indexes are searched exactly.
+
+    def __init__(self, path: str, dim: int, n_tables: int = 8, n_bits: int = 6, exact_threshold: int = 4096, seed: int = 0):
+        self.path = path
+        self.dim = dim
+        self.exact_threshold = exact_threshold
+        self.planes = np.random.default_rng(seed).standard_normal((n_tables, n_bits, dim)).astype(np.float32)
+        self._bit_weights = (1 << np.arange(n_bits)).astype(np.int64)
+        self.buckets: List[Dict[int, List[int]]] = [dict() for _ in range(n_tables)]
+        self.count = 0
+        self._matrix: Optional[np.ndarray] = None
+
+        if os.path.exists(path):
+            size = os.path.getsize(path)
+            row_bytes = dim * 4
+            if size % row_bytes != 0:
+                _logger.warning(f'Truncating partial row in {path}')
+                with open(path, 'r+b') as f:
+                    f.truncate(size - size % row_bytes)
+            self.count = size // row_bytes
+            matrix = self.matrix()
+            for start in range(0, self.count, 8192):
+                block = np.asarray(matrix[start:start + 8192])
+                for offset, keys in enumerate(self._keys(block)):
+                    self._insert(start + offset, keys)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def matrix(self) -> np.ndarray:
+        if self.count == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        if self._matrix is None or self._matrix.shape[0] != self.count:
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        return self._matrix
+
+    def _keys(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, dim) -> (n, n_tables) bucket keys
+        bits = np.einsum('tbd,nd->ntb', self.planes, vectors) > 0
+        return bits.astype(np.int64) @ self._bit_weights
+
+    def _insert(self, row: int, keys: np.ndarray) -> None:
+        for table, key in zip(self.buckets, keys):
+            table.setdefault(int(key), []).append(row)
+
+    def add(self, vector: np.ndarray) -> int:
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        with open(self.path, 'ab') as f:
+            f.write(vector.tobytes())
+        row = self.count
+        self.count += 1
+        self._insert(row, self._keys(vector[None, :])[0])
+        return row
+
+    def search(self, vector: np.ndarray, k: int = 5, min_score: float = -1.0, rows: Optional[Sequence[int]] = None) -> List[Tuple[int, float]]:
+        # `rows` restricts the search to a subset of the index (e.g. one channel's messages)
+        allowed = np.asarray(rows, dtype=np.int64) if rows is not None else None
+        size = self.count if allowed is None else len(allowed)
+        if size == 0:
+            return []
+        vector = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        matrix = self.matrix()
+
+        if size <= self.exact_threshold:
+            rows = np.arange(self.count) if allowed is None else allowed
+        else:
+            candidates = set()
+            for table, key in zip(self.buckets, self._keys(vector[None, :])[0]):
+                candidates.update(table.get(int(key), ()))
+            if allowed is not None:
+                candidates.intersection_update(allowed.tolist())
+            if not candidates:
+                return []
+            rows = np.fromiter(sorted(candidates), dtype=np.int64)
+
+        scores = np.asarray(matrix[rows]) @ vector
+        order = np.argsort(-scores)[:k]
+        return [(int(rows[i]), float(scores[i])) for i in order if scores[i] >= min_score]
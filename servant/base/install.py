@@ -60,3 +60,30 @@ def install_package(*, pip_package_name: str, module_name: str) -> bool:
         #     return False
 
     return False
+
+
+# (pip package, module) pairs needed by the tool modules, which import them lazily.
+REQUIRED_PACKAGES = [
+    ('aiohttp', 'aiohttp'),
+    ('geopy', 'geopy'),
+    ('geocoder', 'geocoder'),
+    ('numpy', 'numpy'),
+    ('requests', 'requests'),
+    ('pytz', 'pytz'),
+    ('Levenshtein', 'Levenshtein'),
+]
+
+
+def preflight() -> bool:
+    # Returns False if any package is still missing afterwards.
+    logger = logging.getLogger(__name__)
+    ok = True
+    for pip_package_name, module_name in REQUIRED_PACKAGES:
+        install_package(pip_package_name=pip_package_name, module_name=module_name)
+        importlib.invalidate_caches()
+        if not _can_import_module(module_name):
+            logger.error(f'{pip_package_name} is still unavailable.')
+            ok = False
+    if ok:
+        logger.info('All required packages are installed.')
+    return ok
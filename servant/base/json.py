@@ -1,10 +1,15 @@
-from typing import TypeAlias
-from dataclasses import is_dataclass, dataclass
+from typing import Any, Callable, Dict, TypeAlias
+from dataclasses import is_dataclass, dataclass, fields
 
 import hashlib
 import json
 import logging
 
+try:
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 _logger = logging.getLogger(__name__)
 
 
@@ -13,24 +18,107 @@ JSONDict = dict[str, JSON]
 JSONArray = list[JSON]
 
 
-def _is_dataclass_instance(obj):
-    return is_dataclass(obj) and not isinstance(obj, type)
+# obj_to_json dispatches on the exact type of each value. Encoders for dataclasses are generated on
+# first use (direct attribute access, primitive fields copied inline); other types are resolved
+# once through their MRO. Encoders take (obj, emit_null).
+Encoder = Callable[[Any, bool], JSON]
+_PRIMITIVES = (str, int, float, bool, type(None))
+_ENCODERS: Dict[type, Encoder] = {t: (lambda obj, emit_null: obj) for t in _PRIMITIVES}
+
+
+def _encode_list(obj, emit_null: bool) -> JSON:
+    return [v if type(v) in _PRIMITIVE_SET else _encoder(type(v))(v, emit_null) for v in obj]
+
+
+def _encode_dict(obj, emit_null: bool) -> JSON:
+    if emit_null:
+        return {k: v if type(v) in _PRIMITIVE_SET else _encoder(type(v))(v, emit_null) for k, v in obj.items()}
+    return {k: v if type(v) in _PRIMITIVE_SET else _encoder(type(v))(v, emit_null) for k, v in obj.items() if v is not None}
+
+
+def _encode_object(obj, emit_null: bool) -> JSON:
+    return _encode_dict(obj.__dict__, emit_null)
+
+
+def _encode_pydantic(obj, emit_null: bool) -> JSON:
+    # pydantic v2 models (OpenAI response objects) serialize themselves much faster than walking __dict__
+    return obj.model_dump(mode='json', exclude_none=not emit_null)
+
+
+def _dataclass_encoder(cls: type) -> Encoder:
+    names = [f.name for f in fields(cls)]
+    lines = ['def encode(obj, emit_null):']
+    for i, name in enumerate(names):
+        lines.append(f'    v{i} = obj.{name}')
+        lines.append(f'    if type(v{i}) not in primitives: v{i} = encoder(type(v{i}))(v{i}, emit_null)')
+    lines.append('    r = {' + ', '.join(f'{name!r}: v{i}' for i, name in enumerate(names)) + '}')
+    lines.append('    return r if emit_null else {k: v for k, v in r.items() if v is not None}')
+    namespace: Dict[str, Any] = {'primitives': _PRIMITIVE_SET, 'encoder': _encoder}
+    exec('\n'.join(lines), namespace)
+    return namespace['encode']
+
+
+def _encoder(cls: type) -> Encoder:
+    encoder = _ENCODERS.get(cls)
+    if encoder is None:
+        if is_dataclass(cls):
+            encoder = _dataclass_encoder(cls)
+        elif hasattr(cls, 'model_dump') and hasattr(cls, 'model_fields'):
+            encoder = _encode_pydantic
+        else:
+            encoder = next((_ENCODERS[base] for base in cls.__mro__[1:] if base in _ENCODERS), None)
+            if encoder is None:
+                _logger.warning(f'Unknown type {cls} in {obj_to_json.__name__}, serializing its __dict__')
+                encoder = _encode_object
+        _ENCODERS[cls] = encoder
+    return encoder
+
+
+_PRIMITIVE_SET = frozenset(_PRIMITIVES)
+_ENCODERS[list] = _encode_list
+_ENCODERS[tuple] = _encode_list
+_ENCODERS[dict] = _encode_dict
+
+
+def register_encoder(cls: type, encoder: Encoder) -> None:
+    _ENCODERS[cls] = encoder
 
 
 def obj_to_json(obj, emit_null=True) -> JSON:
-    if isinstance(obj, list):
-        return [obj_to_json(o) for o in obj]
-    elif isinstance(obj, dict):
-        return {k: obj_to_json(v) for k, v in obj.items() if emit_null or v is not None}
-    elif isinstance(obj, int) or isinstance(obj, float) or isinstance(obj, str) or isinstance(obj, bool) or obj is None:
+    if type(obj) in _PRIMITIVE_SET:
         return obj
-    elif _is_dataclass_instance(obj):
-        return obj_to_json(obj.__dict__)
-    else:
-        _logger.warning(f'Unknown type {type(obj)} in {obj_to_json.__name__}')
-        return obj_to_json(obj.__dict__)
+    return _encoder(type(obj))(obj, emit_null)
+
+
+def dumps_bytes(obj, emit_null=True) -> bytes:
+    # UTF-8 JSON (non-ASCII unescaped, like json.dumps(..., ensure_ascii=False)). orjson serializes
+    # dicts, lists and dataclasses natively and only calls back into obj_to_json for other types.
+    if _orjson is not None and emit_null:
+        return _orjson.dumps(obj, default=obj_to_json, option=_orjson.OPT_NON_STR_KEYS)
+    if _orjson is not None:
+        return _orjson.dumps(obj_to_json(obj, emit_null), option=_orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj_to_json(obj, emit_null), ensure_ascii=False).encode('utf-8')
+
+
+def dumps(obj, emit_null=True) -> str:
+    return dumps_bytes(obj, emit_null).decode('utf-8')
+
+
+def loads(data: str | bytes) -> JSON:
+    return _orjson.loads(data) if _orjson is not None else json.loads(data)
 
 
 def json_hash(obj: JSON) -> str:
     request = json.dumps(obj, sort_keys=True)
     return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+class FrozenJSONArray(tuple):
+    # Immutable JSON array that carries its serialized form and hash, computed once.
+    # json.dumps (and ujson) serialize it like a list.
+
+    def __new__(cls, items) -> 'FrozenJSONArray':
+        self = super().__new__(cls, items)
+        self.serialized = json.dumps(list(self), sort_keys=True)
+        self.hash = hashlib.sha256(self.serialized.encode('utf-8')).hexdigest()
+        return self
@@ -0,0 +1,122 @@
+from typing import Any, List, Optional, Tuple
+from collections import OrderedDict
+
+import asyncio
+import io
+import logging
+
+from servant.base.rate_limiting import TokenBucketRateLimiter
+
+_logger = logging.getLogger(__name__)
+
+DISCORD_MESSAGE_LIMIT = 2000
+_FENCE = '```'
+
+
+def _split_line(line: str, width: int) -> List[str]:
+    # Breaks a line longer than `width` at spaces where possible
+    pieces = []
+    start = 0
+    while len(line) - start > width:
+        cut = line.rfind(' ', start, start + width)
+        if cut <= start:
+            cut = start + width
+        pieces.append(line[start:cut])
+        start = cut
+    pieces.append(line[start:])
+    return pieces
+
+
+def split_message(content: str, limit: int = DISCORD_MESSAGE_LIMIT) -> List[str]:
+    # Single pass over the lines, preferring line breaks, then spaces. A code block cut by a chunk
+    # boundary is closed at the end of the chunk and reopened (with its language) in the next one.
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    fence: Optional[str] = None  # opening line of the code block we are in
+
+    def flush() -> None:
+        nonlocal current, size
+        text = ''.join(current).strip()
+        # Skip chunks holding nothing but a reopened fence
+        if text and text != fence:
+            chunks.append(text + '\n' + _FENCE if fence is not None else text)
+        current = [fence + '\n'] if fence is not None else []
+        size = len(current[0]) if current else 0
+
+    for line in content.splitlines(keepends=True):
+        reserve = len(_FENCE) + 1 if fence is not None else 0
+        reopen = len(fence) + 1 if fence is not None else 0
+        for piece in _split_line(line, limit - reserve - reopen):
+            if size + len(piece) + reserve > limit:
+                flush()
+            current.append(piece)
+            size += len(piece)
+
+        stripped = line.strip()
+        if stripped.startswith(_FENCE):
+            fence = None if fence is not None else stripped
+
+    fence = None
+    flush()
+    return chunks
+
+
+class ChannelSendQueue:
+    # Sends replies one channel at a time, in order, within Discord's per-channel budget of about
+    # 5 messages per 5 seconds. Replies that would take more than `max_chunks` messages are sent as
+    # their first chunk plus the full text as a file attachment.
+    # The per-channel lock and bucket live here, not in the shared limiter registry. Beyond
+    # `max_channels`, idle channels whose bucket has refilled are dropped, then the least recently
+    # used idle ones.
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_chunks: int = 3, attachment_name: str = 'reply.md',
+                 max_channels: int = 1024):
+        self.rate = rate
+        self.burst = burst
+        self.max_chunks = max_chunks
+        self.attachment_name = attachment_name
+        self.max_channels = max_channels
+        self._channels: OrderedDict[Any, Tuple[asyncio.Lock, TokenBucketRateLimiter]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._channels)
+
+    def _channel(self, channel_id: Any) -> Tuple[asyncio.Lock, TokenBucketRateLimiter]:
+        state = self._channels.get(channel_id)
+        if state is None:
+            state = (asyncio.Lock(), TokenBucketRateLimiter(rate=self.rate, burst=self.burst))
+            self._channels[channel_id] = state
+            self._prune(keep=channel_id)
+        self._channels.move_to_end(channel_id)
+        return state
+
+    def _prune(self, keep: Any) -> None:
+        if len(self._channels) <= self.max_channels:
+            return
+        for channel_id, (lock, limiter) in list(self._channels.items()):
+            if channel_id != keep and not lock.locked() and limiter.is_full():
+                del self._channels[channel_id]
+        for channel_id, (lock, _) in list(self._channels.items()):
+            if len(self._channels) <= self.max_channels:
+                break
+            if channel_id != keep and not lock.locked():
+                del self._channels[channel_id]
+
+    async def send(self, channel: Any, content: str) -> None:
+        chunks = split_message(content)
+        if not chunks:
+            return
+
+        lock, limiter = self._channel(channel.id)
+        async with lock:
+            if len(chunks) > self.max_chunks:
+                import discord
+                await limiter()
+                attachment = discord.File(io.BytesIO(content.encode('utf-8')), filename=self.attachment_name)
+                await channel.send(chunks[0], file=attachment)
+                return
+
+            for chunk in chunks:
+                await limiter()
+                await channel.send(chunk)
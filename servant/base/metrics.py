@@ -0,0 +1,100 @@
+from typing import Callable, Dict, List
+from collections import deque
+
+import asyncio
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    def escape(v) -> str:
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class LatencyHistogram:
+    # Keeps the last `window` samples for percentiles, plus all-time count and sum.
+
+    def __init__(self, window: int = 2048):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99)
+        }
+
+    def to_prometheus(self, name: str, labels: Dict[str, str]) -> List[str]:
+        lines = []
+        for q in (0.5, 0.95, 0.99):
+            lines.append(f'{name}{format_labels({**labels, "quantile": str(q)})} {self.percentile(q)}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+# Each provider returns Prometheus text exposition lines (including # TYPE comments).
+MetricsProvider = Callable[[], List[str]]
+_PROVIDERS: List[MetricsProvider] = []
+
+
+def register_metrics(provider: MetricsProvider) -> None:
+    _PROVIDERS.append(provider)
+
+
+def render_metrics() -> str:
+    lines = []
+    for provider in _PROVIDERS:
+        try:
+            lines.extend(provider())
+        except Exception as e:
+            _logger.error(f'Metrics provider {provider} failed: {e}')
+    return '\n'.join(lines) + '\n'
+
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render_metrics().encode('utf-8')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+
+        writer.write(
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = '127.0.0.1', port: int = 9464) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    _logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,115 @@
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import defaultdict
+
+import asyncio
+import functools
+import json
+import logging
+import time
+
+from servant.base.json import obj_to_json, loads as json_loads
+from servant.base.metrics import format_labels
+
+_logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def _prompt_dumps(obj: Any) -> str:
+    # Tool results become prompt text and part of the chat cache key, so they keep the exact
+    # formatting (json.dumps separators, unescaped non-ASCII) of earlier versions
+    return json.dumps(obj_to_json(obj), ensure_ascii=False)
+
+
+class Offloader:
+    # Runs CPU-heavy work off the event loop. Pure-Python work (obj_to_json, prompt/JSON handling)
+    # goes to a thread pool: the loop still gets the GIL every switch interval instead of waiting
+    # for the whole job. Functions marked cpu_bound go to a process pool when one is configured;
+    # they and their arguments must be picklable.
+
+    def __init__(self, threads: int = 4, processes: int = 0, size_threshold: int = 64 * 1024):
+        self.size_threshold = size_threshold
+        self.thread_pool: Executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='offload')
+        self.process_pool: Optional[Executor] = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    def executor(self, cpu_bound: bool = False) -> Executor:
+        return self.process_pool if cpu_bound and self.process_pool is not None else self.thread_pool
+
+    async def run(self, fn: Callable[..., T], *args: Any, cpu_bound: bool = False) -> T:
+        kind = 'process' if cpu_bound and self.process_pool is not None else 'thread'
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor(cpu_bound), functools.partial(fn, *args))
+        finally:
+            self.counts[kind] += 1
+            self.seconds[kind] += time.perf_counter() - t0
+
+    def is_large(self, obj: Any) -> bool:
+        # Bounded walk: stops as soon as `size_threshold` (characters of strings + 8 per node) is exceeded
+        budget = self.size_threshold
+        stack = [obj]
+        while stack:
+            o = stack.pop()
+            if isinstance(o, str):
+                budget -= len(o)
+            elif isinstance(o, dict):
+                stack.extend(o.values())
+                budget -= 8 * len(o)
+            elif isinstance(o, (list, tuple)):
+                stack.extend(o)
+                budget -= 8 * len(o)
+            elif hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            else:
+                budget -= 8
+            if budget < 0:
+                return True
+        return False
+
+    async def dumps(self, obj: Any) -> str:
+        # Tool results to JSON text; large objects are converted off-loop
+        if not self.is_large(obj):
+            self.counts['inline'] += 1
+            return _prompt_dumps(obj)
+        return await self.run(_prompt_dumps, obj)
+
+    async def loads(self, text: str) -> Any:
+        if len(text) < self.size_threshold:
+            self.counts['inline'] += 1
+            return json_loads(text)
+        return await self.run(json_loads, text)
+
+    def prometheus_metrics(self) -> List[str]:
+        lines = ['# TYPE jeeves_offload_tasks_total counter']
+        for kind, count in self.counts.items():
+            lines.append(f'jeeves_offload_tasks_total{format_labels({"executor": kind})} {count}')
+        lines.append('# TYPE jeeves_offload_seconds_total counter')
+        for kind, seconds in self.seconds.items():
+            lines.append(f'jeeves_offload_seconds_total{format_labels({"executor": kind})} {seconds}')
+        return lines
+
+    def shutdown(self) -> None:
+        self.thread_pool.shutdown(wait=False)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False)
+
+
+_OFFLOADER: Optional[Offloader] = None
+
+
+def configure_offload(threads: int = 4, processes: int = 0, size_threshold: int = 64 * 1024) -> Offloader:
+    global _OFFLOADER
+    if _OFFLOADER is not None:
+        _OFFLOADER.shutdown()
+    _OFFLOADER = Offloader(threads=threads, processes=processes, size_threshold=size_threshold)
+    return _OFFLOADER
+
+
+def get_offloader() -> Offloader:
+    global _OFFLOADER
+    if _OFFLOADER is None:
+        _OFFLOADER = Offloader()
+    return _OFFLOADER
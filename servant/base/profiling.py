@@ -0,0 +1,110 @@
+from typing import Dict, Optional
+from collections import defaultdict
+
+import asyncio
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    # Samples every thread's stack via sys._current_frames() from a background thread and
+    # aggregates them in the "collapsed stack" format used by flamegraph.pl / speedscope:
+    #   thread;outer_fn (file:line);...;inner_fn (file:line) <count>
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Dict[str, int] = defaultdict(int)
+        self.sample_count = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        assert self._thread is None, 'Profiler is already running'
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        thread_names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                frames.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[';'.join(reversed(frames))] += 1
+            self.sample_count += 1
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, 'wt', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+
+_ACTIVE_PROFILER: Optional[SamplingProfiler] = None
+
+
+# Upper bound for on-demand profiles (!PROFILE <seconds>)
+MAX_PROFILE_SECONDS = 300.0
+
+_PROFILE_COUNTER = itertools.count()
+
+
+def default_profile_path() -> str:
+    # Milliseconds and a per-process counter, so profiles started in the same second don't collide
+    now = time.time()
+    return time.strftime('profile-%Y%m%d-%H%M%S', time.localtime(now)) + f'.{int(now * 1000) % 1000:03d}-{next(_PROFILE_COUNTER)}.collapsed'
+
+
+def toggle_profiler(path: Optional[str] = None) -> Optional[str]:
+    # Starts profiling if idle; otherwise stops and writes the result. Returns the written path.
+    global _ACTIVE_PROFILER
+    if _ACTIVE_PROFILER is None:
+        _ACTIVE_PROFILER = SamplingProfiler()
+        _ACTIVE_PROFILER.start()
+        _logger.info('Sampling profiler started')
+        return None
+
+    profiler, _ACTIVE_PROFILER = _ACTIVE_PROFILER, None
+    profiler.stop()
+    path = path or default_profile_path()
+    profiler.write_collapsed(path)
+    _logger.info(f'Sampling profiler stopped after {profiler.sample_count} samples, wrote {path}')
+    return path
+
+
+async def profile_for(seconds: float, path: Optional[str] = None, interval: float = 0.005) -> str:
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    path = path or default_profile_path()
+    profiler.write_collapsed(path)
+    _logger.info(f'Profiled {seconds}s ({profiler.sample_count} samples), wrote {path}')
+    return path
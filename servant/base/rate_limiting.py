@@ -1,15 +1,114 @@
+from typing import Dict, List
+from dataclasses import dataclass
+
 import asyncio
 import time
 
-class SimpleRateLimiter:
-    def __init__(self, rate: float) -> None:
+from servant.base.metrics import format_labels
+
+
+@dataclass
+class RateLimiterStats:
+    total_acquired: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+
+    def to_json(self):
+        return {
+            'total_acquired': self.total_acquired,
+            'total_wait_time': self.total_wait_time,
+            'mean_wait_time': self.total_wait_time / self.total_acquired if self.total_acquired else 0.0,
+            'max_wait_time': self.max_wait_time,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth
+        }
+
+
+class TokenBucketRateLimiter:
+    # `rate` tokens per second are added to the bucket, up to `burst` tokens.
+    # Waiters are served in FIFO order: only the head of the queue (the holder of
+    # the lock, which asyncio hands out in acquisition order) sleeps for a token.
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        assert rate > 0 and burst >= 1
         self.rate = rate
-        self.last_request = -1000.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.stats = RateLimiterStats()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        # Idle long enough to have refilled completely: the bucket has no state worth keeping
+        self._refill()
+        return self.tokens >= self.burst and self.stats.queue_depth == 0
+
+    async def acquire(self) -> None:
+        t0 = time.monotonic()
+        self.stats.queue_depth += 1
+        self.stats.max_queue_depth = max(self.stats.max_queue_depth, self.stats.queue_depth)
+        try:
+            async with self._lock:
+                self._refill()
+                while self.tokens < 1.0:
+                    await asyncio.sleep((1.0 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1.0
+        finally:
+            self.stats.queue_depth -= 1
+
+        wait_time = time.monotonic() - t0
+        self.stats.total_acquired += 1
+        self.stats.total_wait_time += wait_time
+        self.stats.max_wait_time = max(self.stats.max_wait_time, wait_time)
 
     async def __call__(self) -> None:
-        now_time = time.time()
-        if self.last_request + self.rate > now_time:
-            await asyncio.sleep(self.last_request + self.rate - now_time)
-            self.last_request = time.time()
-        else:
-            self.last_request = now_time
+        await self.acquire()
+
+
+class SimpleRateLimiter(TokenBucketRateLimiter):
+    # At most one request every `rate` seconds.
+    def __init__(self, rate: float) -> None:
+        super().__init__(rate=1.0 / rate, burst=1)
+
+
+_RATE_LIMITERS: Dict[str, TokenBucketRateLimiter] = {}
+
+
+def get_rate_limiter(name: str, rate: float = 1.0, burst: int = 1) -> TokenBucketRateLimiter:
+    # All callers of one upstream share a bucket; the first caller's settings win.
+    limiter = _RATE_LIMITERS.get(name)
+    if limiter is None:
+        limiter = TokenBucketRateLimiter(rate=rate, burst=burst)
+        _RATE_LIMITERS[name] = limiter
+    return limiter
+
+
+def rate_limiter_stats() -> Dict[str, dict]:
+    return {name: limiter.stats.to_json() for name, limiter in _RATE_LIMITERS.items()}
+
+
+def prometheus_metrics() -> List[str]:
+    # Wait time and queue depth of every named (shared upstream) bucket
+    lines = ['# TYPE jeeves_rate_limiter_wait_seconds summary']
+    for name, limiter in _RATE_LIMITERS.items():
+        labels = format_labels({'limiter': name})
+        lines.append(f'jeeves_rate_limiter_wait_seconds_sum{labels} {limiter.stats.total_wait_time}')
+        lines.append(f'jeeves_rate_limiter_wait_seconds_count{labels} {limiter.stats.total_acquired}')
+    lines.append('# TYPE jeeves_rate_limiter_max_wait_seconds gauge')
+    for name, limiter in _RATE_LIMITERS.items():
+        lines.append(f'jeeves_rate_limiter_max_wait_seconds{format_labels({"limiter": name})} {limiter.stats.max_wait_time}')
+    lines.append('# TYPE jeeves_rate_limiter_queue_depth gauge')
+    for name, limiter in _RATE_LIMITERS.items():
+        lines.append(f'jeeves_rate_limiter_queue_depth{format_labels({"limiter": name})} {limiter.stats.queue_depth}')
+    lines.append('# TYPE jeeves_rate_limiter_max_queue_depth gauge')
+    for name, limiter in _RATE_LIMITERS.items():
+        lines.append(f'jeeves_rate_limiter_max_queue_depth{format_labels({"limiter": name})} {limiter.stats.max_queue_depth}')
+    return lines
@@ -1,29 +1,194 @@
-from typing import Any, Dict, Callable, List, Awaitable
-from dataclasses import dataclass
+from typing import Any, Dict, Callable, List, Awaitable, Optional, Iterable, FrozenSet, Tuple
+from dataclasses import dataclass, field
 
-from servant.base.json import JSON
+import importlib
+import re
+import sys
+
+from servant.base.json import JSON, FrozenJSONArray
+from servant.base.tracing import span
 
 # async def foo(data: JSON) -> Any:
 AsyncToolCallback = Callable[[JSON], Awaitable[Any]]
 
+# Setup (configuration) of lazily imported tool modules, run once the module is first needed
+_MODULE_SETUP: Dict[str, List[Callable[[Any], None]]] = {}
+
+
+def on_module_import(module_name: str, setup: Callable[[Any], None]) -> None:
+    module = sys.modules.get(module_name)
+    if module is not None:
+        setup(module)
+    else:
+        _MODULE_SETUP.setdefault(module_name, []).append(setup)
+
+
+def import_tool_module(module_name: str) -> Any:
+    module = importlib.import_module(module_name)
+    for setup in _MODULE_SETUP.pop(module_name, ()):
+        setup(module)
+    return module
+
+
 @dataclass
 class ToolDef:
     name: str
     schema: JSON
-    function: AsyncToolCallback
+    function: Optional[AsyncToolCallback] = None
+    # 'package.module:attribute', imported on first dispatch when `function` is not given
+    target: Optional[str] = None
+    # Words that make this tool relevant to a message, used by ToolRouter
+    keywords: Tuple[str, ...] = ()
+
+    def resolve(self) -> AsyncToolCallback:
+        if self.function is None:
+            assert self.target is not None, f'Tool {self.name} has neither a function nor a target'
+            module_name, attribute = self.target.split(':')
+            self.function = getattr(import_tool_module(module_name), attribute)
+        return self.function
+
+
+@dataclass(frozen=True)
+class ToolSchemaSnapshot:
+    version: int
+    names: Tuple[str, ...]
+    schema: FrozenJSONArray
+
+    @property
+    def serialized(self) -> str:
+        return self.schema.serialized
+
+    @property
+    def hash(self) -> str:
+        return self.schema.hash
+
+
+@dataclass
+class ToolSelection:
+    schema: FrozenJSONArray
+    names: Tuple[str, ...]
+    estimated_tokens: int
+    full_estimated_tokens: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.full_estimated_tokens - self.estimated_tokens
+
+
+def _estimate_tokens(serialized: str) -> int:
+    return len(serialized) // 4
+
+
+class ToolRouter:
+    # Scores tools against the recent conversation with keyword rules and keeps the top-k.
+    # A small meta tool lets the model ask for the full set when the selection misses something.
+
+    EXPAND_TOOL_NAME = 'request_more_tools'
+    EXPAND_TOOL_SCHEMA = {
+        'type': 'function',
+        'function': {
+            'name': EXPAND_TOOL_NAME,
+            'description': 'Make all of your tools available. Call this if the tool you need is not in your current tool list.'
+        }
+    }
+
+    def __init__(self, top_k: int = 4, always: Iterable[str] = ()):
+        self.top_k = top_k
+        self.always = frozenset(always)
+        self._patterns: Dict[str, Tuple[Tuple[str, ...], Optional[re.Pattern]]] = {}
+
+    def _pattern(self, tool: ToolDef) -> Optional[re.Pattern]:
+        cached = self._patterns.get(tool.name)
+        if cached is None or cached[0] != tool.keywords:
+            pattern = re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in tool.keywords) + r')', re.IGNORECASE) if tool.keywords else None
+            cached = (tool.keywords, pattern)
+            self._patterns[tool.name] = cached
+        return cached[1]
+
+    def score(self, tool: ToolDef, text: str) -> int:
+        pattern = self._pattern(tool)
+        return len(pattern.findall(text)) if pattern is not None else 0
+
+    def select(self, tools: Dict[str, ToolDef], text: str, candidates: Optional[Iterable[str]] = None) -> List[str]:
+        names = [name for name in (candidates if candidates is not None else tools) if name in tools]
+        scored = [(self.score(tools[name], text), name) for name in names if name not in self.always]
+        scored = [(score, name) for score, name in scored if score > 0]
+        scored.sort(key=lambda x: -x[0])
+        selected = [name for name in names if name in self.always] + [name for _, name in scored[:self.top_k]]
+        return selected
 
 
 @dataclass
 class ToolDispatcher:
     tools: Dict[str, ToolDef]
+    # Optional per-channel subsets of tool names; channels without an entry get every tool.
+    channel_tools: Dict[str, FrozenSet[str]] = field(default_factory=dict)
+
+    router: Optional[ToolRouter] = None
+
+    version: int = 0
+    _snapshots: Dict[Optional[FrozenSet[str]], ToolSchemaSnapshot] = field(default_factory=dict, repr=False)
+
+    def snapshot(self, names: Optional[Iterable[str]] = None) -> ToolSchemaSnapshot:
+        # Snapshots are built once per (version, subset) and invalidated by register().
+        key = frozenset(names) if names is not None else None
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            selected = tuple(name for name in self.tools if key is None or name in key)
+            snapshot = ToolSchemaSnapshot(
+                version=self.version,
+                names=selected,
+                schema=FrozenJSONArray(self.tools[name].schema for name in selected))
+            self._snapshots[key] = snapshot
+        return snapshot
 
     @property
-    def schema(self) -> List[JSON]:
-        return [tool.schema for name, tool in self.tools.items()]
+    def schema(self) -> FrozenJSONArray:
+        return self.snapshot().schema
+
+    def schema_for_channel(self, channel_id: str) -> FrozenJSONArray:
+        return self.snapshot(self.channel_tools.get(channel_id)).schema
+
+    def select_schema(self, channel_id: str, text: str, expanded: bool = False, include: Iterable[str] = ()) -> ToolSelection:
+        # With a router, only tools relevant to `text` (plus `include`, e.g. tools already called in
+        # this exchange) are sent, along with the router's meta tool. `expanded` sends everything.
+        candidates = self.channel_tools.get(channel_id)
+        if self.router is not None:
+            candidates = [name for name in (candidates if candidates is not None else self.tools) if name != ToolRouter.EXPAND_TOOL_NAME]
+        full = self.snapshot(candidates)
+        if self.router is None or expanded:
+            return ToolSelection(full.schema, full.names, _estimate_tokens(full.serialized), _estimate_tokens(full.serialized))
+
+        selected = set(self.router.select(self.tools, text, candidates)) | set(include)
+        selected.add(ToolRouter.EXPAND_TOOL_NAME)
+        snapshot = self.snapshot(selected)
+        return ToolSelection(snapshot.schema, snapshot.names, _estimate_tokens(snapshot.serialized), _estimate_tokens(full.serialized))
+
+    def enable_routing(self, router: ToolRouter) -> None:
+        async def expand(data: JSON) -> Any:
+            return {'message': 'All tools are now available.'}
+        self.router = router
+        self.register(ToolRouter.EXPAND_TOOL_NAME, ToolRouter.EXPAND_TOOL_SCHEMA, expand)
+
+    def set_channel_tools(self, channel_id: str, names: Optional[Iterable[str]]) -> None:
+        if names is None:
+            self.channel_tools.pop(channel_id, None)
+        else:
+            self.channel_tools[channel_id] = frozenset(names)
+
+    def _invalidate(self) -> None:
+        self.version += 1
+        self._snapshots.clear()
 
     async def dispatch(self, tool_name: str, data: JSON) -> Any:
         tool = self.tools[tool_name]
-        return await tool.function(data)
+        with span('tool.dispatch', tool=tool_name):
+            return await tool.resolve()(data)
+
+    def register(self, name: str, schema: Dict[str, Any], function: AsyncToolCallback, keywords: Iterable[str] = ()) -> None:
+        self.tools[name] = ToolDef(name=name, schema=schema, function=function, keywords=tuple(keywords))
+        self._invalidate()
 
-    def register(self, name: str, schema: Dict[str, Any], function: AsyncToolCallback) -> None:
-        self.tools[name] = ToolDef(name=name, schema=schema, function=function)
+    def register_lazy(self, name: str, schema: Dict[str, Any], target: str, keywords: Iterable[str] = ()) -> None:
+        self.tools[name] = ToolDef(name=name, schema=schema, target=target, keywords=tuple(keywords))
+        self._invalidate()
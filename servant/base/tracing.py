@@ -0,0 +1,129 @@
+from typing import Any, Dict, Iterator, List, Optional
+from dataclasses import dataclass, field
+from contextlib import contextmanager
+
+import contextvars
+import json
+import logging
+import os
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+# Field names follow the OpenTelemetry (OTLP/JSON) span model so the output can be
+# converted or fed to OTel tooling without remapping.
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_time_unix_nano: int
+    end_time_unix_nano: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status_code: str = 'STATUS_CODE_UNSET'
+    status_message: str = ''
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time_unix_nano - self.start_time_unix_nano) / 1e9
+
+    def to_json(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id or '',
+            'name': self.name,
+            'startTimeUnixNano': str(self.start_time_unix_nano),
+            'endTimeUnixNano': str(self.end_time_unix_nano),
+            'attributes': self.attributes,
+            'status': {'code': self.status_code, 'message': self.status_message}
+        }
+
+
+class JsonlSpanExporter:
+    # Buffers finished spans and appends them to a JSONL file once a trace completes.
+
+    def __init__(self, path: str, max_buffer: int = 256):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.buffer: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.buffer.append(span)
+        if span.parent_span_id is None or len(self.buffer) >= self.max_buffer:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        try:
+            with open(self.path, 'at', encoding='utf-8') as f:
+                for span in self.buffer:
+                    f.write(json.dumps(span.to_json(), ensure_ascii=False, default=str) + '\n')
+        except OSError as e:
+            _logger.error(f'Failed to write spans to {self.path}: {e}')
+        self.buffer.clear()
+
+
+class CollectingSpanExporter:
+    # Keeps finished spans in memory, e.g. for benchmarks.
+
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+SpanExporter = JsonlSpanExporter | CollectingSpanExporter
+
+_EXPORTER: Optional[SpanExporter] = None
+_CURRENT_SPAN: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+def configure_tracing(path: Optional[str]) -> None:
+    set_span_exporter(JsonlSpanExporter(path) if path is not None else None)
+
+
+def set_span_exporter(exporter: Optional[SpanExporter]) -> None:
+    global _EXPORTER
+    _EXPORTER = exporter
+
+
+def current_span() -> Optional[Span]:
+    return _CURRENT_SPAN.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    # No-op (yields None) unless tracing is configured.
+    if _EXPORTER is None:
+        yield None
+        return
+
+    parent = _CURRENT_SPAN.get()
+    s = Span(
+        name=name,
+        trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+        span_id=os.urandom(8).hex(),
+        parent_span_id=parent.span_id if parent is not None else None,
+        start_time_unix_nano=time.time_ns(),
+        attributes=attributes)
+
+    token = _CURRENT_SPAN.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status_code = 'STATUS_CODE_ERROR'
+        s.status_message = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        s.end_time_unix_nano = time.time_ns()
+        _CURRENT_SPAN.reset(token)
+        if _EXPORTER is not None:
+            _EXPORTER.export(s)
@@ -0,0 +1,30 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import re
+
+
+class TriggerMatcher:
+    # Decides whether a message addresses a personality ("Jeeves ...", "J, ..."). Each personality's
+    # triggers are compiled once into a single alternation, so a check is one regex scan.
+
+    def __init__(self, personalities: Iterable[str] = ()):
+        self._patterns: Dict[str, re.Pattern] = {}
+        for name in personalities:
+            self.add(name)
+
+    @staticmethod
+    def triggers_for(name: str) -> Tuple[str, ...]:
+        # Full name and its initial
+        return (name, name[0]) if len(name) > 1 else (name,)
+
+    def add(self, name: str, triggers: Optional[Iterable[str]] = None) -> None:
+        # Longest first so "Jeeves" is preferred over "J" inside the alternation
+        alternatives = sorted(set(triggers if triggers is not None else self.triggers_for(name)), key=len, reverse=True)
+        self._patterns[name] = re.compile(r'\b(?:' + '|'.join(re.escape(t) for t in alternatives) + r')\b', re.IGNORECASE)
+
+    def matches(self, name: str, text: str) -> bool:
+        pattern = self._patterns.get(name)
+        if pattern is None:
+            self.add(name)
+            pattern = self._patterns[name]
+        return pattern.search(text) is not None
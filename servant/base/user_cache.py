@@ -0,0 +1,112 @@
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import asyncio
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UserInfo:
+    id: int
+    name: str
+    discriminator: str = '0'
+
+    def to_json(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'discriminator': self.discriminator
+        }
+
+    @classmethod
+    def from_user(cls, user: Any) -> 'UserInfo':
+        # discord.User / discord.Member
+        return cls(id=user.id, name=user.name, discriminator=getattr(user, 'discriminator', '0'))
+
+
+class UserInfoCache:
+    # TTL + LRU cache of user id -> UserInfo. Fed for free from gateway data (message mentions,
+    # member cache); only misses go to `fetch`, concurrently and with one request per id in flight.
+
+    def __init__(self, fetch: Callable[[int], Awaitable[Any]], max_size: int = 4096, ttl: float = 6 * 3600):
+        self.fetch = fetch
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[int, tuple[float, UserInfo]] = OrderedDict()
+        self.in_flight: Dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[UserInfo]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires, info = entry
+        if expires < time.monotonic():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return info
+
+    def put(self, info: UserInfo) -> None:
+        self.entries[info.id] = (time.monotonic() + self.ttl, info)
+        self.entries.move_to_end(info.id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def put_users(self, users: Iterable[Any]) -> None:
+        for user in users:
+            self.put(UserInfo.from_user(user))
+
+    async def _fetch(self, user_id: int) -> Optional[UserInfo]:
+        future = self.in_flight.get(user_id)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The fetching task was cancelled: a miss for us, unless we were cancelled ourselves
+                if future.cancelled():
+                    return None
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[user_id] = future
+        info = None
+        try:
+            info = UserInfo.from_user(await self.fetch(user_id))
+            self.put(info)
+        except Exception as e:
+            _logger.error(f'Failed to fetch user {user_id}: {e}')
+        except BaseException:
+            # Cancelled: waiters see a cancelled future and treat it as a miss
+            future.cancel()
+            raise
+        finally:
+            del self.in_flight[user_id]
+            # Settle the shared future on every path, so waiters never hang
+            if not future.done():
+                future.set_result(info)
+        return info
+
+    async def resolve(self, user_ids: Iterable[int], fetch_missing: bool = True) -> Dict[int, UserInfo]:
+        # Cached users are returned immediately; with `fetch_missing`, the rest are fetched concurrently.
+        result: Dict[int, UserInfo] = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            info = self.get(user_id)
+            if info is not None:
+                self.hits += 1
+                result[user_id] = info
+            else:
+                self.misses += 1
+                missing.append(user_id)
+
+        if missing and fetch_missing:
+            for user_id, info in zip(missing, await asyncio.gather(*(self._fetch(user_id) for user_id in missing))):
+                if info is not None:
+                    result[user_id] = info
+        return result
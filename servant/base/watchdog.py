@@ -0,0 +1,117 @@
+from typing import Deque, List, Optional
+from collections import deque
+from dataclasses import dataclass
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from servant.base.metrics import LatencyHistogram
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LoopStall:
+    start_time: float
+    duration: float
+    stack: List[str]
+
+    def to_json(self):
+        return {
+            'start_time': self.start_time,
+            'duration': self.duration,
+            'stack': self.stack
+        }
+
+
+class LoopWatchdog:
+    # A heartbeat task on the loop measures scheduling lag (how late a `sleep(interval)` wakes up).
+    # A watcher thread checks the heartbeat; once it is older than `threshold`, the loop thread's
+    # stack is captured, which is the blocking callback caught in the act (a synchronous HTTP
+    # request, sqlite query, ...). The stall's full duration is logged when the loop recovers.
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5, history: int = 32):
+        self.interval = interval
+        self.threshold = threshold
+        self.lag = LatencyHistogram()
+        self.stalls: Deque[LoopStall] = deque(maxlen=history)
+        self.stall_count = 0
+        self.stall_seconds = 0.0
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # Stack captured by the watcher for the stall in progress
+        self._pending_stack: Optional[List[str]] = None
+
+    def start(self) -> None:
+        assert self._task is None, 'Watchdog is already running'
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag >= self.threshold:
+                stall = LoopStall(start_time=time.time() - lag, duration=lag, stack=self._pending_stack or [])
+                self._pending_stack = None
+                self.stalls.append(stall)
+                self.stall_count += 1
+                self.stall_seconds += lag
+                _logger.warning(f'Event loop blocked for {lag:.3f}s' + (':\n' + ''.join(stall.stack) if stall.stack else ''))
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval / 2):
+            if self._pending_stack is not None:
+                continue
+            if time.monotonic() - self._last_beat - self.interval < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._pending_stack = traceback.format_stack(frame)
+
+    def to_json(self):
+        return {
+            'lag': self.lag.to_json(),
+            'max_lag': self.max_lag,
+            'stall_count': self.stall_count,
+            'stall_seconds': self.stall_seconds,
+            'recent_stalls': [stall.to_json() for stall in self.stalls]
+        }
+
+    def prometheus_metrics(self) -> List[str]:
+        lines = ['# TYPE jeeves_event_loop_lag_seconds summary']
+        lines.extend(self.lag.to_prometheus('jeeves_event_loop_lag_seconds', {}))
+        lines.append('# TYPE jeeves_event_loop_max_lag_seconds gauge')
+        lines.append(f'jeeves_event_loop_max_lag_seconds {self.max_lag}')
+        lines.append('# TYPE jeeves_event_loop_stalls_total counter')
+        lines.append(f'jeeves_event_loop_stalls_total {self.stall_count}')
+        lines.append('# TYPE jeeves_event_loop_stall_seconds_total counter')
+        lines.append(f'jeeves_event_loop_stall_seconds_total {self.stall_seconds}')
+        return lines
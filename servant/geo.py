@@ -1,22 +1,20 @@
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict, List, Sequence
 from dataclasses import dataclass
 
 import time
 import json
 import asyncio
+import logging
+import sqlite3
+import unicodedata
 
-from servant.base.rate_limiting import SimpleRateLimiter
-from servant.base.tools import ToolDef
-from servant.base.install import install_package
+from servant.base.rate_limiting import get_rate_limiter
+from servant.base.json import obj_to_json, JSON, JSONDict
 
-install_package(pip_package_name='geopy', module_name='geopy')
-import geopy.distance
+import aiohttp
 
-install_package(pip_package_name='geocoder', module_name='geocoder')
-import geocoder
-
-install_package(pip_package_name='requests', module_name='requests')
-import requests
+# geopy, geocoder and numpy are imported where they are used; they are slow to import and
+# only needed once a geo tool is actually called. Run `python servant.py --preflight` to install them.
 
 
 @dataclass
@@ -24,56 +22,239 @@ class GeocoderResult:
     location: str
     longitude: float
     latitude: float
-    country: str
-    state: str
-    city: str
-    street: str
+    country: str | None
+    state: str | None
+    city: str | None
+    street: str | None
 
 
-_GEOCODER_RATE_LIMITER = SimpleRateLimiter(1.0)
-async def geocode(location: str) -> Optional[GeocoderResult]:
-    await _GEOCODER_RATE_LIMITER()
+_logger = logging.getLogger(__name__)
+
+
+def _normalize_query(location: str) -> str:
+    # "  New  York, USA " and "new york, usa" should hit the same cache entry.
+    location = unicodedata.normalize('NFKC', location).casefold()
+    parts = [' '.join(part.split()) for part in location.split(',')]
+    return ', '.join(part for part in parts if part)
+
+
+class GeocodeCache:
+    def __init__(self, db_path: str, table_name: str = 'geocode_cache'):
+        self.table_name = table_name
+        self.conn = sqlite3.connect(db_path)
+        self.cursor = self.conn.cursor()
+
+        self.cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                query TEXT PRIMARY KEY,
+                result TEXT,
+                created_time REAL
+            )
+        ''')
+
+    def get(self, query: str) -> Optional[GeocoderResult]:
+        self.cursor.execute(f'SELECT result FROM {self.table_name} WHERE query=?', (query,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return GeocoderResult(**json.loads(row[0]))
+
+    def put(self, query: str, result: GeocoderResult) -> None:
+        self.cursor.execute(f'INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?)',
+            (query, json.dumps(obj_to_json(result)), time.time()))
+        self.conn.commit()
+
+
+class Gazetteer:
+    # Offline place index built from a GeoNames dump (e.g. cities15000.txt from
+    # https://download.geonames.org/export/dump/). Each name maps to its most populous place.
+
+    def __init__(self):
+        self.places: Dict[str, GeocoderResult] = {}
+        self.populations: Dict[str, int] = {}
+
+    def add(self, name: str, result: GeocoderResult, population: int = 0) -> None:
+        key = _normalize_query(name)
+        if not key:
+            return
+        if key not in self.places or population > self.populations[key]:
+            self.places[key] = result
+            self.populations[key] = population
+
+    def lookup(self, query: str) -> Optional[GeocoderResult]:
+        return self.places.get(_normalize_query(query))
+
+    @classmethod
+    def from_geonames(cls, path: str) -> 'Gazetteer':
+        gazetteer = cls()
+        with open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 15:
+                    continue
+                name, ascii_name, latitude, longitude, country_code = cols[1], cols[2], float(cols[4]), float(cols[5]), cols[8]
+                population = int(cols[14] or 0)
+                result = GeocoderResult(
+                    location=name, longitude=longitude, latitude=latitude,
+                    country=country_code, state=None, city=name, street=None)
+
+                for n in {name, ascii_name}:
+                    gazetteer.add(n, result, population)
+                    gazetteer.add(f'{n}, {country_code}', result, population)
+
+        _logger.info(f'Loaded {len(gazetteer.places)} gazetteer entries from {path}')
+        return gazetteer
+
+
+_GEOCODE_CACHE: Optional[GeocodeCache] = None
+_GAZETTEER: Optional[Gazetteer] = None
+_GAZETTEER_PATH: Optional[str] = None
+
+
+def configure_geocoder(cache_path: Optional[str] = None, gazetteer_path: Optional[str] = None) -> None:
+    global _GEOCODE_CACHE, _GAZETTEER, _GAZETTEER_PATH
+    if cache_path is not None:
+        _GEOCODE_CACHE = GeocodeCache(cache_path)
+    if gazetteer_path is not None:
+        # Loaded on first lookup
+        _GAZETTEER, _GAZETTEER_PATH = None, gazetteer_path
+
+
+def _gazetteer() -> Optional[Gazetteer]:
+    global _GAZETTEER, _GAZETTEER_PATH
+    if _GAZETTEER is None and _GAZETTEER_PATH is not None:
+        _GAZETTEER, _GAZETTEER_PATH = Gazetteer.from_geonames(_GAZETTEER_PATH), None
+    return _GAZETTEER
+
+
+def _geocode_osm(location: str) -> Optional[GeocoderResult]:
+    import geocoder
     g = geocoder.osm(location)
+    if not g.ok or g.latlng is None:
+        return None
     lat, lng = g.latlng
-    # return g.x, g.y
     return GeocoderResult(
         location=location, longitude=lng, latitude=lat,
         country=g.country, state=g.state, city=g.city,
         street=g.street)
 
 
-_DRIVING_DISTANCE_RATE_LIMITER = SimpleRateLimiter(1.0)
+# Nominatim usage policy: at most 1 request per second
+_GEOCODER_RATE_LIMITER = get_rate_limiter('nominatim', rate=1.0)
+async def geocode(location: str) -> Optional[GeocoderResult]:
+    query = _normalize_query(location)
+
+    gazetteer = _gazetteer()
+    if gazetteer is not None:
+        result = gazetteer.lookup(query)
+        if result is not None:
+            return result
+
+    if _GEOCODE_CACHE is not None:
+        result = _GEOCODE_CACHE.get(query)
+        if result is not None:
+            return result
+
+    await _GEOCODER_RATE_LIMITER()
+    # geocoder is synchronous, keep it off the event loop
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, _geocode_osm, location)
+
+    if result is not None and _GEOCODE_CACHE is not None:
+        _GEOCODE_CACHE.put(query, result)
+    return result
+
+
+_OSRM_URL = 'http://router.project-osrm.org'
+
+
+def configure_osrm(url: str) -> None:
+    # Point at a local OSRM (e.g. http://localhost:5000) to avoid the public demo server's limits.
+    global _OSRM_URL
+    _OSRM_URL = url.rstrip('/')
+
+
+def _osrm_coordinates(points: List[GeocoderResult]) -> str:
+    # LONGITUDE FIRST
+    return ';'.join(f'{p.longitude},{p.latitude}' for p in points)
+
+
+_DRIVING_DISTANCE_RATE_LIMITER = get_rate_limiter('osrm', rate=1.0)
 async def driving_distance(p1: GeocoderResult, p2: GeocoderResult) -> Optional[float]:
     await _DRIVING_DISTANCE_RATE_LIMITER()
-    url = 'http://router.project-osrm.org/route/v1/driving/'
+    url = f'{_OSRM_URL}/route/v1/driving/{_osrm_coordinates([p1, p2])}'
 
-    # LONGITUDE FIRST
-    o1 = str(p1.longitude) + ',' + str(p1.latitude)
-    o2 = str(p2.longitude) + ',' + str(p2.latitude)
-    x = o1 + ';' + o2
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+            return data['routes'][0]['distance']*0.001 #in km
 
-    response = requests.get(url+x)
-    data = json.loads(response.content)
 
-    if response.status_code == 200:
-        return data['routes'][0]['distance']*0.001 #in km
-    else:
-        return None
+async def driving_distance_matrix(points: List[GeocoderResult]) -> Optional[List[List[Optional[float]]]]:
+    # One /table request instead of N^2 /route requests. Unreachable pairs come back as None.
+    await _DRIVING_DISTANCE_RATE_LIMITER()
+    url = f'{_OSRM_URL}/table/v1/driving/{_osrm_coordinates(points)}?annotations=distance'
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+            if data.get('code') != 'Ok':
+                return None
+            return [[d * 0.001 if d is not None else None for d in row] for row in data['distances']]
+
+
+_EARTH_RADIUS_KM = 6371.0088
+
+def haversine_matrix(latitudes: Sequence[float], longitudes: Sequence[float]) -> 'np.ndarray':
+    import numpy as np
+
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
 
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * _EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
 
-async def distance(p1, p2):
-    if isinstance(p1, str):
-        g = geocoder.osm(p1)
-        print('%s resolved to %s (long=%s lat=%s)' % (p1, g, g.x, g.y))
-        p1 = (g.x, g.y)
 
-    if isinstance(p2, str):
-        g = geocoder.osm(p2)
-        print('%s resolved to %s (long=%s lat=%s)' % (p2, g, g.x, g.y))
-        p2 = (g.x, g.y)
+async def _resolve(p: str | GeocoderResult) -> Optional[GeocoderResult]:
+    if isinstance(p, str):
+        return await geocode(p)
+    return p
 
-    geodesic_km = geopy.distance.geodesic(reversed(p1), reversed(p2)).km
-    driving_km = driving_distance(p1, p2)
+
+async def distance_matrix(points: List[str | GeocoderResult], driving: bool = True) -> JSONDict:
+    resolved = await asyncio.gather(*[_resolve(p) for p in points])
+    missing = [p for p, r in zip(points, resolved) if r is None]
+    if missing:
+        return {'error': 'Could not find geocode for some locations', 'data': {'locations': obj_to_json(missing)}}
+
+    geodesic_km = haversine_matrix([p.latitude for p in resolved], [p.longitude for p in resolved])
+
+    result: JSONDict = {
+        'locations': [{'location': p.location, 'latitude': p.latitude, 'longitude': p.longitude} for p in resolved],
+        'geodesic_km': geodesic_km.round(1).tolist(),
+    }
+    if driving and len(resolved) > 1:
+        driving_km = await driving_distance_matrix(resolved)
+        result['driving_km'] = [[round(d, 1) if d is not None else None for d in row] for row in driving_km] if driving_km is not None else None
+    return result
+
+
+async def distance(p1: str | GeocoderResult, p2: str | GeocoderResult) -> Tuple[Optional[float], Optional[float]]:
+    p1, p2 = await asyncio.gather(_resolve(p1), _resolve(p2))
+    if p1 is None or p2 is None:
+        return None, None
+
+    import geopy.distance
+    geodesic_km = geopy.distance.geodesic((p1.latitude, p1.longitude), (p2.latitude, p2.longitude)).km
+    driving_km = await driving_distance(p1, p2)
     return geodesic_km, driving_km
 
-# print(distance('Milwaukee', 'Toronto'))
+
+async def get_distance_matrix_tool(obj: JSONDict) -> JSON:
+    return await distance_matrix(obj['locations'], obj.get('driving', True))
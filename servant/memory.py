@@ -0,0 +1,157 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+import asyncio
+import functools
+import logging
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from servant.base.embedding import HashedNgramEmbedder, VectorIndex
+
+_logger = logging.getLogger(__name__)
+
+# "Message from <user>: " is shared by every user message and would dominate short ones
+_SENDER_PREFIX_RE = re.compile(r'^Message from [^:]*:\s*')
+
+
+def _embedding_text(content: str) -> str:
+    return _SENDER_PREFIX_RE.sub('', content)
+
+
+@dataclass
+class MemoryItem:
+    channel_id: str
+    role: str
+    content: str
+    created_time: float
+    score: float = 0.0
+
+    def to_json(self):
+        return {
+            'channel_id': self.channel_id,
+            'role': self.role,
+            'content': self.content,
+            'created_time': self.created_time,
+            'score': self.score
+        }
+
+
+class ConversationMemory:
+    # Long-term recall for conversations: every user/assistant message is embedded locally and
+    # appended to an on-disk vector index (servant.base.embedding), with the text kept in sqlite.
+    # Prompts then carry only the few past messages relevant to the current one instead of
+    # an ever-growing history.
+    # The sqlite connection and vector file are only touched on a private thread, off the event
+    # loop: add() queues the write and returns, recall() is awaited. Both run in submission order.
+
+    def __init__(self, db_path: str, vectors_path: Optional[str] = None, table_name: str = 'memory'):
+        self.table_name = table_name
+        self.embedder = HashedNgramEmbedder()
+        self.index = VectorIndex(vectors_path or db_path + '.vectors', self.embedder.dim)
+        # Note title -> (updated_time, embedding); notes live in JeevesState, only their vectors are cached here
+        self._note_vectors: Dict[str, Tuple[int, np.ndarray]] = {}
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory')
+        # Only used from the executor thread after construction
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                row INTEGER PRIMARY KEY,
+                channel_id TEXT,
+                role TEXT,
+                content TEXT,
+                created_time REAL
+            )
+        ''')
+
+        # Index rows of each channel's messages; recall only searches the current channel's rows,
+        # so busy channels can't crowd it out of the results
+        self._channel_rows: Dict[str, List[int]] = {}
+        self.cursor.execute(f'SELECT row, channel_id FROM {self.table_name} ORDER BY row')
+        stored = 0
+        for row, channel_id in self.cursor.fetchall():
+            stored += 1
+            if row < len(self.index):
+                self._channel_rows.setdefault(channel_id, []).append(row)
+        if stored != len(self.index):
+            # The vector file is appended before the row is committed, so a crash in between leaves
+            # vectors without text; those rows are simply never returned.
+            _logger.warning(f'Memory index has {len(self.index)} vectors but {stored} stored messages')
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def add(self, channel_id: str, role: str, content: str) -> Optional[Future]:
+        if not content or not content.strip():
+            return None
+        return self._executor.submit(self._add, channel_id, role, content)
+
+    def _add(self, channel_id: str, role: str, content: str) -> None:
+        row = self.index.add(self.embedder.embed(_embedding_text(content)))
+        self.cursor.execute(f'INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?, ?, ?)',
+            (row, channel_id, role, content, time.time()))
+        self.conn.commit()
+        self._channel_rows.setdefault(channel_id, []).append(row)
+
+    async def recall(self, channel_id: str, query: str, k: int = 5, min_score: float = 0.2, exclude: Iterable[str] = ()) -> List[MemoryItem]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(self._recall, channel_id, query, k, min_score, list(exclude)))
+
+    def _recall(self, channel_id: str, query: str, k: int, min_score: float, exclude: Iterable[str]) -> List[MemoryItem]:
+        # Past messages of this channel most similar to `query`, oldest first. Messages in
+        # `exclude` (e.g. the ones already in the prompt) are skipped.
+        rows = self._channel_rows.get(channel_id)
+        if not query.strip() or not rows:
+            return []
+        exclude = set(exclude)
+
+        # Every hit is from this channel; leave room for the excluded and repeated messages
+        hits = self.index.search(self.embedder.embed(_embedding_text(query)), k=2 * k + len(exclude), min_score=min_score, rows=rows)
+        if not hits:
+            return []
+        self.cursor.execute(
+            f'SELECT row, channel_id, role, content, created_time FROM {self.table_name} WHERE row IN ({",".join("?" * len(hits))})',
+            [row for row, _ in hits])
+        entries = {entry[0]: entry[1:] for entry in self.cursor.fetchall()}
+
+        items = []
+        for row, score in hits:
+            entry = entries.get(row)
+            if entry is None or entry[2] in exclude:
+                continue
+            exclude.add(entry[2])
+            items.append(MemoryItem(channel_id=entry[0], role=entry[1], content=entry[2], created_time=entry[3], score=score))
+            if len(items) >= k:
+                break
+
+        items.sort(key=lambda item: item.created_time)
+        return items
+
+    def rank_notes(self, notes: Dict[str, Tuple[str, int]], query: str, k: int = 5, min_score: float = 0.15) -> List[str]:
+        # `notes` maps title -> (content, updated_time); returns up to `k` titles relevant to `query`.
+        if not notes or not query.strip():
+            return []
+
+        for title in list(self._note_vectors):
+            if title not in notes:
+                del self._note_vectors[title]
+
+        titles = list(notes)
+        vectors = []
+        for title in titles:
+            content, updated_time = notes[title]
+            cached = self._note_vectors.get(title)
+            if cached is None or cached[0] != updated_time:
+                cached = (updated_time, self.embedder.embed(f'{title}\n{content}'))
+                self._note_vectors[title] = cached
+            vectors.append(cached[1])
+
+        scores = np.stack(vectors) @ self.embedder.embed(_embedding_text(query))
+        order = np.argsort(-scores)[:k]
+        return [titles[i] for i in order if scores[i] >= min_score]
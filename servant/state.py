@@ -0,0 +1,82 @@
+from typing import Dict, List, Tuple
+
+import json
+import logging
+import sqlite3
+
+from servant.base.json import JSONDict
+
+_logger = logging.getLogger(__name__)
+
+
+def connect_shared(db_path: str) -> sqlite3.Connection:
+    # Connection for a database shared by several bot processes: WAL lets readers proceed during a
+    # write, and writers wait for each other instead of failing with "database is locked".
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class SharedStateStore:
+    # Notes, schedule and channel personalities shared by all shard worker processes. Every write is
+    # committed immediately; readers call changed() (PRAGMA data_version, which only moves when
+    # another connection commits) to decide whether their in-memory copy needs reloading.
+
+    def __init__(self, db_path: str):
+        self.conn = connect_shared(db_path)
+        self.cursor = self.conn.cursor()
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notes (
+                title TEXT PRIMARY KEY,
+                data TEXT
+            )''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schedule (
+                title TEXT PRIMARY KEY,
+                data TEXT
+            )''')
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS channel_personality (
+                channel_id TEXT PRIMARY KEY,
+                personality TEXT
+            )''')
+        self.conn.commit()
+        self._data_version = None
+
+    def changed(self) -> bool:
+        self.cursor.execute('PRAGMA data_version')
+        version = self.cursor.fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def load(self) -> Tuple[List[JSONDict], List[JSONDict], Dict[str, str]]:
+        # (notes, schedule items) as JSON, and channel id -> personality name
+        self.cursor.execute('SELECT data FROM notes')
+        notes = [json.loads(row[0]) for row in self.cursor.fetchall()]
+        self.cursor.execute('SELECT data FROM schedule')
+        schedule = [json.loads(row[0]) for row in self.cursor.fetchall()]
+        self.cursor.execute('SELECT channel_id, personality FROM channel_personality')
+        personalities = dict(self.cursor.fetchall())
+        return notes, schedule, personalities
+
+    def put_note(self, title: str, data: JSONDict) -> None:
+        self.cursor.execute('INSERT OR REPLACE INTO notes VALUES (?, ?)', (title, json.dumps(data)))
+        self.conn.commit()
+
+    def delete_note(self, title: str) -> None:
+        self.cursor.execute('DELETE FROM notes WHERE title=?', (title,))
+        self.conn.commit()
+
+    def put_schedule_item(self, title: str, data: JSONDict) -> None:
+        self.cursor.execute('INSERT OR REPLACE INTO schedule VALUES (?, ?)', (title, json.dumps(data)))
+        self.conn.commit()
+
+    def delete_schedule_item(self, title: str) -> None:
+        self.cursor.execute('DELETE FROM schedule WHERE title=?', (title,))
+        self.conn.commit()
+
+    def set_channel_personality(self, channel_id: str, personality: str) -> None:
+        self.cursor.execute('INSERT OR REPLACE INTO channel_personality VALUES (?, ?)', (channel_id, personality))
+        self.conn.commit()
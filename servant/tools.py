@@ -0,0 +1,107 @@
+# Declarations of the built-in tool modules. Schemas are declared here so the model can see
+# them from startup, while the implementing modules (and their heavy dependencies) are only
+# imported on the first dispatch of one of their tools.
+from servant.base.tools import ToolDispatcher
+
+
+def register_builtin_tools(tools: ToolDispatcher) -> None:
+    tools.register_lazy(
+        name="get_current_weather",
+        schema={
+            "type": "function",
+            "function": {
+                "name": "get_current_weather",
+                "description": "Get the current weather in a given location. Specify the location as precisely as possible.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {
+                            "type": "object",
+                            "description": "The location that will be used to get the weather forecast.",
+                            "properties": {
+                                "latitude": {
+                                    "type": "number",
+                                    "description": "The latitude of the location."
+                                },
+                                "longitude": {
+                                    "type": "number",
+                                    "description": "The longitude of the location."
+                                }
+                            },
+                            "required": ["latitude", "longitude"]
+                        }
+                    },
+                    "required": ["location"],
+                },
+            },
+        },
+        target='servant.weather:get_current_weather_tool',
+        keywords=['weather', 'temperature', 'forecast', 'rain', 'snow', 'wind', 'sunny', 'cloudy', 'humid', 'cold', 'hot', 'warm']
+    )
+
+    tools.register_lazy(
+        name="get_current_weather_batch",
+        schema={
+            "type": "function",
+            "function": {
+                "name": "get_current_weather_batch",
+                "description": "Get the current weather for several locations at once. Prefer this over repeated get_current_weather calls when comparing places.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "locations": {
+                            "type": "array",
+                            "description": "The locations to get the weather for. One result is returned per location, in the same order.",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "latitude": {
+                                        "type": "number",
+                                        "description": "The latitude of the location."
+                                    },
+                                    "longitude": {
+                                        "type": "number",
+                                        "description": "The longitude of the location."
+                                    }
+                                },
+                                "required": ["latitude", "longitude"]
+                            }
+                        }
+                    },
+                    "required": ["locations"],
+                },
+            },
+        },
+        target='servant.weather:get_current_weather_batch_tool',
+        keywords=['weather', 'temperature', 'forecast', 'rain', 'snow', 'wind', 'compare', 'warmer', 'colder']
+    )
+
+    tools.register_lazy(
+        name="get_distance_matrix",
+        schema={
+            "type": "function",
+            "function": {
+                "name": "get_distance_matrix",
+                "description": "Get the great-circle and driving distances (in km) between every pair of the given locations.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "locations": {
+                            "type": "array",
+                            "description": "The locations, as precisely as possible, e.g. \"City, Country\".",
+                            "items": {
+                                "type": "string"
+                            }
+                        },
+                        "driving": {
+                            "type": "boolean",
+                            "description": "Whether to also compute driving distances. Defaults to true."
+                        }
+                    },
+                    "required": ["locations"],
+                },
+            },
+        },
+        target='servant.geo:get_distance_matrix_tool',
+        keywords=['distance', 'far', 'km', 'kilometer', 'mile', 'drive', 'driving', 'route', 'how long']
+    )
@@ -1,15 +1,12 @@
 import aiohttp
 import asyncio
-from typing import Optional
+from typing import Optional, Tuple
 from dataclasses import dataclass, field
 from typing import List
-from servant.base.tools import ToolDef, ToolDispatcher
 from servant.base.json import JSON, JSONDict, obj_to_json
 
 # https://open-meteo.com/
 
-from servant.geo import geocode
-
 
 @dataclass
 class CurrentWeather:
@@ -32,9 +29,29 @@ class WeatherForecast:
     hourly: HourlyWeather
 
 
+_CURRENT_FIELDS = 'temperature_2m,apparent_temperature,is_day,precipitation,rain,showers,snowfall,cloud_cover,wind_speed_10m,wind_gusts_10m'
+
+
+def _shape_current_weather(r: JSONDict) -> JSONDict:
+    return {
+        'latitude': r['latitude'],
+        'longitude': r['longitude'],
+        'temperature_2m': str(r['current']['temperature_2m']) + ' ' + r['current_units']['temperature_2m'],
+        'apparent_temperature': str(r['current']['apparent_temperature']) + ' ' + r['current_units']['apparent_temperature'],
+        'is_day': True if r['current']['is_day'] == 1 else False,
+        'precipitation': str(r['current']['precipitation']) + ' ' + r['current_units']['precipitation'],
+        'rain': str(r['current']['rain']) + ' ' + r['current_units']['rain'],
+        'showers': str(r['current']['showers']) + ' ' + r['current_units']['showers'],
+        'snowfall': str(r['current']['snowfall']) + ' ' + r['current_units']['snowfall'],
+        'cloud_cover': str(r['current']['cloud_cover']) + ' ' + r['current_units']['cloud_cover'],
+        'wind_speed_10m': str(r['current']['wind_speed_10m']) + ' ' + r['current_units']['wind_speed_10m'],
+        'wind_gusts_10m': str(r['current']['wind_gusts_10m']) + ' ' + r['current_units']['wind_gusts_10m']
+    }
+
+
 async def fetch_weather_forecast(latitude: float, longitude: float) -> JSONDict:
     api_url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}"
-    api_url += f"&current=temperature_2m,apparent_temperature,is_day,precipitation,rain,showers,snowfall,cloud_cover,wind_speed_10m,wind_gusts_10m"
+    api_url += f"&current={_CURRENT_FIELDS}"
 
     async with aiohttp.ClientSession() as session:
         async with session.get(api_url) as response:
@@ -78,22 +95,29 @@ async def fetch_weather_forecast(latitude: float, longitude: float) -> JSONDict:
             #     }
             # }
 
-            result = {
-                'latitude': r['latitude'],
-                'longitude': r['longitude'],
-                'temperature_2m': str(r['current']['temperature_2m']) + ' ' + r['current_units']['temperature_2m'],
-                'apparent_temperature': str(r['current']['apparent_temperature']) + ' ' + r['current_units']['apparent_temperature'],
-                'is_day': True if r['current']['is_day'] == 1 else False,
-                'precipitation': str(r['current']['precipitation']) + ' ' + r['current_units']['precipitation'],
-                'rain': str(r['current']['rain']) + ' ' + r['current_units']['rain'],
-                'showers': str(r['current']['showers']) + ' ' + r['current_units']['showers'],
-                'snowfall': str(r['current']['snowfall']) + ' ' + r['current_units']['snowfall'],
-                'cloud_cover': str(r['current']['cloud_cover']) + ' ' + r['current_units']['cloud_cover'],
-                'wind_speed_10m': str(r['current']['wind_speed_10m']) + ' ' + r['current_units']['wind_speed_10m'],
-                'wind_gusts_10m': str(r['current']['wind_gusts_10m']) + ' ' + r['current_units']['wind_gusts_10m']
-            }
+            return _shape_current_weather(r)
+
+
+async def fetch_weather_forecast_batch(locations: List[Tuple[float, float]]) -> List[JSONDict]:
+    # open-meteo accepts comma-separated coordinate lists and answers with one object per location
+    # (or a bare object if only one location was requested).
+    if not locations:
+        return []
+
+    latitudes = ','.join(str(lat) for lat, _ in locations)
+    longitudes = ','.join(str(lng) for _, lng in locations)
+    api_url = f"https://api.open-meteo.com/v1/forecast?latitude={latitudes}&longitude={longitudes}"
+    api_url += f"&current={_CURRENT_FIELDS}"
 
-            return result
+    async with aiohttp.ClientSession() as session:
+        async with session.get(api_url) as response:
+            r = await response.json()
+
+            if isinstance(r, dict):
+                r = [r]
+            assert len(r) == len(locations), f'Expected {len(locations)} results, got {len(r)}'
+
+            return [_shape_current_weather(item) for item in r]
 
 
 async def get_current_weather(latitude: float, longitude: float) -> JSON:
@@ -105,37 +129,17 @@ async def get_current_weather(latitude: float, longitude: float) -> JSON:
     return r
 
 
+async def get_current_weather_batch(locations: List[JSONDict]) -> JSON:
+    coords = [(loc['latitude'], loc['longitude']) for loc in locations]
+    results = await fetch_weather_forecast_batch(coords)
+    for (latitude, longitude), r in zip(coords, results):
+        r['location'] = obj_to_json({'latitude': latitude, 'longitude': longitude})
+    return results
+
+
+async def get_current_weather_tool(obj: JSONDict) -> JSON:
+    return await get_current_weather(obj['location']['latitude'], obj['location']['longitude'])
+
 
-def register_tools(tools: ToolDispatcher) -> None:
-    tools.register(
-        name="get_current_weather",
-        schema={
-            "type": "function",
-            "function": {
-                "name": "get_current_weather",
-                "description": "Get the current weather in a given location. Specify the location as precisely as possible.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "location": {
-                            "type": "object",
-                            "description": "The location that will be used to get the weather forecast.",
-                            "properties": {
-                                "latitude": {
-                                    "type": "number",
-                                    "description": "The latitude of the location."
-                                },
-                                "longitude": {
-                                    "type": "number",
-                                    "description": "The longitude of the location."
-                                }
-                            },
-                            "required": ["latitude", "longitude"]
-                        }
-                    },
-                    "required": ["location"],
-                },
-            },
-        },
-        function=lambda obj: get_current_weather(obj['location']['latitude'], obj['location']['longitude'])
-    )
+async def get_current_weather_batch_tool(obj: JSONDict) -> JSON:
+    return await get_current_weather_batch(obj['locations'])
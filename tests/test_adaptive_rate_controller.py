@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('ujson')
+
+from gpt import AdaptiveRateController
+
+
+def test_limit_bounds_concurrency():
+    async def main():
+        controller = AdaptiveRateController(initial_limit=2)
+        active = 0
+        peak = 0
+
+        async def request():
+            nonlocal active, peak
+            await controller.acquire()
+            try:
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+            finally:
+                controller.release()
+
+        await asyncio.gather(*(request() for _ in range(10)))
+        assert peak == 2
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    async def main():
+        controller = AdaptiveRateController(initial_limit=1)
+        await controller.acquire()
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release()
+        assert controller.in_flight == 0
+
+        await asyncio.wait_for(controller.acquire(), timeout=1)
+        assert controller.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_woken_then_cancelled_waiter_passes_the_slot_on():
+    async def main():
+        controller = AdaptiveRateController(initial_limit=1)
+        await controller.acquire()
+        first = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        # Wake the first waiter, then cancel it before it runs
+        controller.release()
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, timeout=1)
+        assert controller.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_cancellation_during_pause_releases_the_slot():
+    async def main():
+        controller = AdaptiveRateController(initial_limit=1)
+        controller.pause(10)
+        task = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0.01)
+        assert controller.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_overload_halves_limit_and_success_grows_it():
+    controller = AdaptiveRateController(initial_limit=8, min_limit=1)
+    controller.on_overload()
+    assert controller.limit == 4
+    controller.on_success()
+    assert controller.limit == pytest.approx(4.25)
+    for _ in range(10):
+        controller.on_overload()
+    assert controller.limit == 1
+
+
+def test_retry_budget_is_refilled_by_successes():
+    controller = AdaptiveRateController(retry_budget=2, retry_refill=0.5)
+    assert controller.take_retry()
+    assert controller.take_retry()
+    assert not controller.take_retry()
+    controller.on_success()
+    controller.on_success()
+    assert controller.take_retry()
+
+
+def test_rate_limit_headers_pause_requests():
+    controller = AdaptiveRateController()
+    controller.on_success({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s'})
+    assert controller.paused_until > 0
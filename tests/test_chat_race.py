@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('ujson')
+
+from gpt import ChatBackend, ChatRace, ChatResponse, mock_completion, set_accounting_labels
+
+
+class SlowBackend(ChatBackend):
+    def __init__(self, delay: float, content: str = 'ok', finish_reason: str = 'stop', fail: bool = False):
+        self.delay = delay
+        self.content = content
+        self.finish_reason = finish_reason
+        self.fail = fail
+        self.calls = 0
+        self.cancelled = 0
+
+    async def async_request(self, **kwargs) -> ChatResponse:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError('backend failed')
+        completion = mock_completion(self.content)
+        completion['choices'][0]['finish_reason'] = self.finish_reason
+        return ChatResponse.from_dict(completion, timing={'start': 0.0, 'end': self.delay})
+
+
+def content(response: ChatResponse) -> str:
+    return response.choices[0]['message']['content']
+
+
+def race(backends, **kwargs) -> ChatResponse:
+    return asyncio.run(ChatRace(backends, **kwargs).async_request(messages=[]))
+
+
+def test_fastest_response_wins_and_others_are_cancelled():
+    slow, fast = SlowBackend(0.5, 'slow'), SlowBackend(0.01, 'fast')
+    t0 = time.perf_counter()
+    assert content(race([slow, fast])) == 'fast'
+    assert time.perf_counter() - t0 < 0.4
+    assert slow.cancelled == 1
+
+
+def test_hedge_starts_next_backend_after_delay():
+    slow, fast = SlowBackend(0.5, 'slow'), SlowBackend(0.01, 'fast')
+    assert content(race([slow, fast], hedge_delay=0.05)) == 'fast'
+    assert fast.calls == 1
+
+
+def test_no_hedge_when_first_backend_is_fast_enough():
+    first, second = SlowBackend(0.01, 'first'), SlowBackend(0.01, 'second')
+    assert content(race([first, second], hedge_delay=0.5)) == 'first'
+    assert second.calls == 0
+
+
+def test_failure_starts_next_backend_immediately():
+    failing, backup = SlowBackend(0.01, fail=True), SlowBackend(0.01, 'backup')
+    t0 = time.perf_counter()
+    assert content(race([failing, backup], hedge_delay=5)) == 'backup'
+    assert time.perf_counter() - t0 < 1
+
+
+def test_rejected_response_is_the_fallback():
+    truncated, failing = SlowBackend(0.01, 'truncated', finish_reason='length'), SlowBackend(0.02, fail=True)
+    assert content(race([truncated, failing])) == 'truncated'
+
+
+def test_last_error_is_raised_when_all_fail():
+    with pytest.raises(RuntimeError):
+        race([SlowBackend(0.01, fail=True), SlowBackend(0.02, fail=True)])
+
+
+def test_quantile_delay_includes_cancelled_attempts():
+    async def main():
+        slow, fast = SlowBackend(0.2, 'slow'), SlowBackend(0.01, 'fast')
+        chat_race = ChatRace([slow, fast], hedge_delay=0.05, hedge_quantile=0.95, min_samples=3)
+        for _ in range(3):
+            assert content(await chat_race.async_request(messages=[])) == 'fast'
+        # Cancelled attempts are recorded as (censored) samples of at least the hedge delay
+        assert chat_race.latency[0].count == 3
+        assert chat_race.delay(0) >= 0.05
+
+    asyncio.run(main())
+
+
+def test_race_only_in_listed_channels():
+    async def main():
+        first, second = SlowBackend(0.01, 'first'), SlowBackend(0.0, 'second')
+        chat_race = ChatRace([first, second], channels=['fast-channel'])
+        set_accounting_labels(channel='other')
+        assert content(await chat_race.async_request(messages=[])) == 'first'
+        assert second.calls == 0
+        set_accounting_labels(channel='fast-channel')
+        assert content(await chat_race.async_request(messages=[])) == 'second'
+
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import pickle
+import sqlite3
+
+import pytest
+
+pytest.importorskip('openai')
+pytest.importorskip('ujson')
+
+from gpt import ChatBackend, ChatMock, ChatResponse, ChatSqliteCache, mock_completion
+
+
+def test_decodes_lazily_and_keeps_raw_body():
+    raw = json.dumps(mock_completion('hello')).encode('utf-8')
+    response = ChatResponse.from_bytes(raw, timing={'start': 0.0, 'end': 1.0})
+    assert response.to_bytes() is raw
+    assert response.choices[0]['message']['content'] == 'hello'
+    assert response.usage.prompt_tokens == 0
+    assert response[ChatBackend.TIMING_FIELD] == {'start': 0.0, 'end': 1.0}
+    assert response.to_bytes() is raw
+
+
+def test_top_level_edit_is_reencoded():
+    response = ChatResponse.from_dict(mock_completion('hello'))
+    response['model'] = 'other'
+    assert json.loads(response.to_text())['model'] == 'other'
+
+
+def test_legacy_in_band_fields_and_null_calls_are_removed():
+    legacy = mock_completion('hello')
+    legacy['choices'][0]['message']['tool_calls'] = None
+    legacy[ChatBackend.TIMING_FIELD] = {'start': 0.0, 'end': 1.0}
+    response = ChatResponse.from_bytes(json.dumps(legacy), cached=True)
+    assert ChatBackend.TIMING_FIELD not in response
+    assert 'tool_calls' not in response.choices[0]['message']
+    assert response.get(ChatBackend.CACHED_FIELD) is True
+
+
+def test_pickle_round_trip():
+    response = ChatResponse.from_dict(mock_completion('hello'), cached=True)
+    restored = pickle.loads(pickle.dumps(response))
+    assert restored.cached
+    assert restored.to_dict() == response.to_dict()
+
+
+def test_sqlite_cache_stores_text_and_returns_cached_response(tmp_path):
+    db_path = str(tmp_path / 'cache.db')
+
+    async def main():
+        cache = ChatSqliteCache(ChatMock(['hello']), db_path)
+        fresh = await cache.async_request(model='mock', messages=[{'role': 'user', 'content': 'hi'}])
+        cached = await cache.async_request(model='mock', messages=[{'role': 'user', 'content': 'hi'}])
+        return fresh, cached
+
+    fresh, cached = asyncio.run(main())
+    assert not fresh.cached and cached.cached
+    assert cached.choices[0]['message']['content'] == 'hello'
+    assert sqlite3.connect(db_path).execute('SELECT typeof(response) FROM chat_cache').fetchall() == [('text',)]
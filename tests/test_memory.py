@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from servant.memory import ConversationMemory
+
+
+def test_recall_is_limited_to_the_channel(tmp_path):
+    async def main():
+        memory = ConversationMemory(str(tmp_path / 'memory.db'))
+        memory.add('c1', 'user', 'Message from Bob: my favourite pizza topping is mushrooms')
+        for i in range(200):
+            memory.add(f'other{i % 10}', 'user', f'Message from Ann: pizza toppings are great, mushrooms number {i}')
+        return await memory.recall('c1', 'what pizza topping do I like?')
+
+    items = asyncio.run(main())
+    assert [item.channel_id for item in items] == ['c1']
+    assert 'mushrooms' in items[0].content
+
+
+def test_excluded_messages_are_skipped(tmp_path):
+    async def main():
+        memory = ConversationMemory(str(tmp_path / 'memory.db'))
+        memory.add('c1', 'user', 'the train leaves at noon')
+        return await memory.recall('c1', 'when does the train leave', exclude=['the train leaves at noon'])
+
+    assert asyncio.run(main()) == []
+
+
+def test_memory_is_reloaded_from_disk(tmp_path):
+    async def main():
+        memory = ConversationMemory(str(tmp_path / 'memory.db'))
+        memory.add('c1', 'user', 'the train leaves at noon').result()
+        return await ConversationMemory(str(tmp_path / 'memory.db')).recall('c1', 'when does the train leave')
+
+    assert [item.content for item in asyncio.run(main())] == ['the train leaves at noon']
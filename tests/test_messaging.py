@@ -0,0 +1,74 @@
+import asyncio
+
+from servant.base.messaging import ChannelSendQueue, split_message
+
+FENCE = '```'
+
+
+def test_short_message_is_one_chunk():
+    assert split_message('Very good, sir.') == ['Very good, sir.']
+
+
+def test_empty_message_has_no_chunks():
+    assert split_message('   \n') == []
+
+
+def test_chunks_respect_limit_and_prefer_line_breaks():
+    content = '\n'.join(f'line {i} ' + 'x' * 40 for i in range(100))
+    chunks = split_message(content, limit=200)
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.startswith('line ') for chunk in chunks)
+    assert '\n'.join(chunks).split('\n') == content.split('\n')
+
+
+def test_long_line_is_split_at_spaces():
+    content = ' '.join(['word'] * 200)
+    chunks = split_message(content, limit=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert ' '.join(chunks).split() == content.split()
+
+
+def test_unbroken_line_is_hard_split():
+    chunks = split_message('x' * 250, limit=100)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
+
+
+def test_code_block_is_closed_and_reopened_across_chunks():
+    code = '\n'.join(f'print({i})' for i in range(60))
+    content = f'Here you go:\n{FENCE}python\n{code}\n{FENCE}\nDone.'
+    chunks = split_message(content, limit=200)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 200
+        assert chunk.count(FENCE) % 2 == 0
+    for chunk in chunks[1:-1]:
+        assert chunk.startswith(f'{FENCE}python\n')
+    assert chunks[-1].endswith('Done.')
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content, file=None):
+        self.sent.append((content, file))
+
+
+def test_send_queue_sends_chunks_in_order():
+    channel = FakeChannel(1)
+    content = '\n'.join(f'line {i}' for i in range(400))
+    queue = ChannelSendQueue(rate=1000.0, burst=1000, max_chunks=5)
+    asyncio.run(queue.send(channel, content))
+    assert [file for _, file in channel.sent] == [None] * len(channel.sent)
+    assert '\n'.join(text for text, _ in channel.sent) == content
+
+
+def test_send_queue_keeps_a_bounded_number_of_channels():
+    async def main():
+        queue = ChannelSendQueue(rate=1000.0, burst=5, max_channels=8)
+        for channel_id in range(100):
+            await queue.send(FakeChannel(channel_id), 'hello')
+        return queue
+
+    assert len(asyncio.run(main())) <= 8
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import pytest
+
+from servant.base.rate_limiting import TokenBucketRateLimiter, SimpleRateLimiter, get_rate_limiter
+
+
+def test_burst_is_served_immediately():
+    async def main():
+        limiter = TokenBucketRateLimiter(rate=1.0, burst=5)
+        t0 = time.monotonic()
+        for _ in range(5):
+            await limiter()
+        return time.monotonic() - t0
+
+    assert asyncio.run(main()) < 0.05
+
+
+def test_rate_is_enforced_after_burst():
+    async def main():
+        limiter = TokenBucketRateLimiter(rate=50.0, burst=1)
+        t0 = time.monotonic()
+        for _ in range(6):
+            await limiter()
+        return time.monotonic() - t0
+
+    # 5 refills at 50/s
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_waiters_are_served_in_fifo_order():
+    async def main():
+        limiter = TokenBucketRateLimiter(rate=100.0, burst=1)
+        order = []
+
+        async def waiter(i: int):
+            await limiter()
+            order.append(i)
+
+        await asyncio.gather(*(waiter(i) for i in range(5)))
+        return order, limiter.stats
+
+    order, stats = asyncio.run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert stats.total_acquired == 5
+    # The first waiter gets the burst token without queueing behind anyone
+    assert stats.max_queue_depth == 4
+    assert stats.queue_depth == 0
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        limiter = TokenBucketRateLimiter(rate=1.0, burst=1)
+        await limiter()
+        task = asyncio.ensure_future(limiter())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return limiter.stats
+
+    stats = asyncio.run(main())
+    assert stats.queue_depth == 0
+    assert stats.total_acquired == 1
+
+
+def test_simple_rate_limiter_allows_one_request_per_interval():
+    limiter = SimpleRateLimiter(2.0)
+    assert limiter.rate == 0.5
+    assert limiter.burst == 1
+
+
+def test_named_limiters_are_shared():
+    first = get_rate_limiter('test.shared', rate=3.0, burst=2)
+    assert get_rate_limiter('test.shared', rate=100.0) is first
+    assert first.rate == 3.0
+
+
+def test_named_limiters_are_exported():
+    from servant.base.rate_limiting import prometheus_metrics
+
+    limiter = get_rate_limiter('test.exported', rate=10.0, burst=1)
+    asyncio.run(limiter())
+    lines = prometheus_metrics()
+    assert 'jeeves_rate_limiter_wait_seconds_count{limiter="test.exported"} 1' in lines
+    assert 'jeeves_rate_limiter_queue_depth{limiter="test.exported"} 0' in lines
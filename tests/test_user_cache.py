@@ -0,0 +1,82 @@
+import asyncio
+
+from servant.base.user_cache import UserInfo, UserInfoCache
+
+
+class User:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.name = f'user{user_id}'
+
+
+def test_cached_users_are_not_fetched():
+    async def fetch(user_id):
+        raise AssertionError('should not fetch')
+
+    async def main():
+        cache = UserInfoCache(fetch)
+        cache.put(UserInfo(id=1, name='alice'))
+        return await cache.resolve([1], fetch_missing=True)
+
+    assert asyncio.run(main())[1].name == 'alice'
+
+
+def test_concurrent_misses_share_one_fetch():
+    calls = []
+
+    async def fetch(user_id):
+        calls.append(user_id)
+        await asyncio.sleep(0.01)
+        return User(user_id)
+
+    async def main():
+        cache = UserInfoCache(fetch)
+        return await asyncio.gather(cache.resolve([1, 2]), cache.resolve([1]))
+
+    first, second = asyncio.run(main())
+    assert sorted(calls) == [1, 2]
+    assert first[1].name == second[1].name == 'user1'
+
+
+def test_failed_fetch_is_a_miss():
+    async def fetch(user_id):
+        raise RuntimeError('not found')
+
+    async def main():
+        return await UserInfoCache(fetch).resolve([1])
+
+    assert asyncio.run(main()) == {}
+
+
+def test_cancelled_fetch_does_not_hang_waiters():
+    async def fetch(user_id):
+        await asyncio.sleep(10)
+        return User(user_id)
+
+    async def main():
+        cache = UserInfoCache(fetch)
+        first = asyncio.ensure_future(cache.resolve([1]))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.resolve([1]))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        result = await asyncio.wait_for(second, timeout=1)
+        assert first.cancelled()
+        return result, cache
+
+    result, cache = asyncio.run(main())
+    assert result == {}
+    assert cache.in_flight == {}
+
+
+def test_lru_evicts_oldest():
+    async def fetch(user_id):
+        return User(user_id)
+
+    cache = UserInfoCache(fetch, max_size=2)
+    for user_id in (1, 2):
+        cache.put(UserInfo(id=user_id, name=str(user_id)))
+    cache.get(1)
+    cache.put(UserInfo(id=3, name='3'))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None